@@ -268,7 +268,7 @@ async def get_chat_history(
     api_logger.info(f"获取聊天历史: conversation_id={conversation_id}, user={user}")
 
     try:
-        messages = chat_service.get_conversation_history(
+        messages = await chat_service.get_conversation_history(
             conversation_id=conversation_id,
             user_id=user,
             limit=limit
@@ -8,6 +8,8 @@ MONGODB_SETTINGS: Dict = {
         "mongodb://你的用户名:你的密码@你的MongoDB地址:端口/admin",
     ),
     "database": os.getenv("MONGODB_DB", "你的数据库名"),
+    # 连接池大小，并发较高时（如迁移脚本的 --concurrency）可调大
+    "pool_size": int(os.getenv("MONGODB_POOL_SIZE", "50")),
     "collections": {
         "posts": "article",
         "news": "AccNews",
@@ -18,6 +20,7 @@ MONGODB_SETTINGS: Dict = {
         "user_profile": "UserProfile",
         "quotes": "dayk",
         "exponent": "exponent",
+        "chat_history": "ChatHistory",
     },
 }
 
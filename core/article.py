@@ -1,5 +1,5 @@
+import asyncio
 import re
-import time
 from datetime import datetime
 from typing import List, Dict
 
@@ -10,7 +10,7 @@ from logger import task_logger
 from models.database import EventsArticleDB, UserProfileDB, MarketDB, PostsDB
 from prompt.article import *
 from prompt.util import *
-from services.llm import LLMService
+from services.llm import get_llm_service
 from utils.time_utils import calculate_base_time
 from utils.tools import extract_square_bracket_contents, process_text
 
@@ -24,7 +24,7 @@ class ArticleGenerator:
         self.user_db = UserProfileDB()
         self.market_db = MarketDB()
         self.posts_db = PostsDB()
-        self.llm = LLMService()
+        self.llm = get_llm_service()
         self.end_time, self.start_time = calculate_base_time(
             datetime.now(), type=self.article_type
         )
@@ -120,7 +120,7 @@ class ArticleGenerator:
             # 生成逻辑复盘文章
             while True:
                 try:
-                    think_response, json_response = self.llm.call_llm(messages=messages)
+                    think_response, json_response = await asyncio.to_thread(self.llm.call_llm, messages=messages, json_mode=True)
                     if json_response:
                         article = json_response["content"].strip()
                         break
@@ -128,7 +128,7 @@ class ArticleGenerator:
                         task_logger.error(f"生成逻辑复盘文章时发生错误,重新尝试...")
                 except ValueError as e:
                     task_logger.error(f"生成逻辑复盘文章时发生错误: {str(e)}")
-                time.sleep(60)
+                await asyncio.sleep(60)
             # 事件追踪
             article = await self.get_traced_content(
                 content=article,
@@ -167,7 +167,7 @@ class ArticleGenerator:
             {"role": "user", "content": full_prompt},
         ]
 
-        content_response = self.llm.call_llm(messages=messages)[1]
+        content_response = (await asyncio.to_thread(self.llm.call_llm, messages=messages, json_mode=True))[1]
         if content_response:
             content = content_response["content"].strip()
 
@@ -189,7 +189,7 @@ class ArticleGenerator:
                     ),
                 },
             ]
-            content_response = self.llm.call_llm(messages=messages)[1]
+            content_response = (await asyncio.to_thread(self.llm.call_llm, messages=messages, json_mode=True))[1]
             if content_response:
                 content = content_response["content"].strip()
             if len(content) < 1500:
@@ -225,7 +225,7 @@ class ArticleGenerator:
             {"role": "system", "content": AssessmentQualityStyleMigrationSystemPrompt},
             {"role": "user", "content": full_prompt},
         ]
-        think_response, evaluation_response = self.llm.call_llm(messages=messages)
+        think_response, evaluation_response = await asyncio.to_thread(self.llm.call_llm, messages=messages, json_mode=True)
         if evaluation_response:
             evaluation_report = evaluation_response["EvaluationReport"]
             overall_score = float(evaluation_report["OverallScore"])
@@ -244,7 +244,7 @@ class ArticleGenerator:
                     },
                 ]
                 try:
-                    _, call_quality_genration = self.llm.call_llm(messages=messages)
+                    _, call_quality_genration = await asyncio.to_thread(self.llm.call_llm, messages=messages, json_mode=True)
                     if call_quality_genration:
                         generated_content = call_quality_genration["content"].strip()
                 except Exception as e:
@@ -295,7 +295,7 @@ class ArticleGenerator:
                 {"role": "user", "content": full_prompt},
             ]
 
-            think_response, json_response = self.llm.call_llm(messages=messages)
+            think_response, json_response = await asyncio.to_thread(self.llm.call_llm, messages=messages, json_mode=True)
             if not json_response:
                 task_logger.error(
                     "事件追踪时发生错误，模型上下文输入超限，取消正文内容输入，重新执行......"
@@ -372,7 +372,7 @@ class ArticleService(ArticleGenerator):
                     return
             except Exception as e:
                 task_logger.error(f"生成文章失败: {str(e)}")
-                time.sleep(60)
+                await asyncio.sleep(60)
 
     async def send_feishu_message(self, message: str):
         """发送飞书消息"""
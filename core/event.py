@@ -9,7 +9,7 @@ from logger import task_logger
 from models.database import EventsArticleDB, NewsDB
 from prompt.event import *
 from prompt.util import OutputFormatConstraint
-from services.llm import LLMService
+from services.llm import get_llm_service
 from utils.task_utils import TaskManager
 from utils.time_utils import calculate_base_time
 from utils.tools import remove_sensitive_information
@@ -24,7 +24,7 @@ class EventProcessor:
         self.news_db = NewsDB()
         # 使用events_db实例中的mongodb连接
         self.mongodb = self.events_db.mongodb
-        self.llm = LLMService()
+        self.llm = get_llm_service()
         self.task_mgr = TaskManager()
         self.now = datetime.now()
         self.end_time, self.start_time = calculate_base_time(
@@ -50,7 +50,7 @@ class EventProcessor:
             {"role": "user", "content": full_prompt},
         ]
 
-        think_response, json_response = self.llm.call_llm(messages=messages)
+        think_response, json_response = self.llm.call_llm(messages=messages, json_mode=True)
 
         if not json_response:
             task_logger.error("事件对比失败，未能获取有效结果")
@@ -74,7 +74,7 @@ class EventProcessor:
             {"role": "user", "content": full_prompt},
         ]
 
-        think_response, json_response = self.llm.call_llm(messages=messages)
+        think_response, json_response = self.llm.call_llm(messages=messages, json_mode=True)
 
         if not json_response:
             task_logger.error("事件整合提取失败，未能获取有效结果")
@@ -248,7 +248,7 @@ class EventProcessor:
             {"role": "user", "content": full_prompt},
         ]
 
-        think_response, json_response = self.llm.call_llm(messages=messages)
+        think_response, json_response = self.llm.call_llm(messages=messages, json_mode=True)
 
         if not json_response:
             task_logger.error(f"{events['id']} 事件整合提炼失败，未能获取有效结果")
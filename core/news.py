@@ -8,7 +8,7 @@ from logger import task_logger
 from models.database import EventsArticleDB, NewsDB, MarketDB, UserProfileDB
 from prompt.news import *
 from prompt.util import OutputFormatConstraint
-from services.llm import LLMService
+from services.llm import get_llm_service
 from utils.task_utils import TaskManager
 from utils.time_utils import calculate_base_time
 from utils.tools import remove_sensitive_information
@@ -26,7 +26,7 @@ class NewsProcessor:
         self.user_db = UserProfileDB()
         # 使用events_db实例中的mongodb连接
         self.mongodb = self.events_db.mongodb
-        self.llm = LLMService()
+        self.llm = get_llm_service()
         self.task_mgr = TaskManager()
         self.now = datetime.now()
         self.end_time, self.start_time = calculate_base_time(self.now, type=self.type)
@@ -158,7 +158,7 @@ class NewsProcessor:
                 {"role": "user", "content": full_prompt},
             ]
 
-            think_response, json_response = self.llm.call_llm(messages=messages)
+            think_response, json_response = self.llm.call_llm(messages=messages, json_mode=True)
 
             if not json_response:
                 task_logger.error(f"无法解析新闻要点: {news.get('id')}")
@@ -191,7 +191,7 @@ class NewsProcessor:
                 {"role": "system", "content": NewsSelcetionTopicSystemPrompt},
                 {"role": "user", "content": full_prompt},
             ]
-            think_response, json_response = self.llm.call_llm(messages=messages)
+            think_response, json_response = self.llm.call_llm(messages=messages, json_mode=True)
 
             if not json_response:
                 task_logger.error(f"无法分析主题: {news.get('id')}")
@@ -226,7 +226,7 @@ class NewsProcessor:
                 {"role": "system", "content": FilterLogicalNewsSystemPrompt},
                 {"role": "user", "content": full_prompt},
             ]
-            think_response, json_response = self.llm.call_llm(messages=messages)
+            think_response, json_response = self.llm.call_llm(messages=messages, json_mode=True)
 
             if not json_response:
                 task_logger.error(f"无法过滤新闻: {news.get('id')}")
@@ -1,35 +1,80 @@
-from collections import Counter
+import asyncio
+import hashlib
+import json
+from collections import Counter, OrderedDict, defaultdict
 from datetime import datetime
 from itertools import chain
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 import pandas as pd
 
 from core.event import EventProcessor
 from logger import task_logger
-from models.database import PostsDB, UserProfileDB, NewsDB
+from models.database import get_posts_db, get_news_db, get_user_profile_db
 from prompt.posts import *
-from prompt.util import OutputFormatConstraint
-from services.llm import LLMService
+from prompt.util import bind_output_constraint
+from services.llm import get_llm_service
 from utils.task_utils import TaskManager
 from utils.time_utils import calculate_base_time
 from utils.html_parser import HTMLContentProcessor
 
+# 模块加载时预先填充输出格式约束
+ThemeAnalysisPrompt = bind_output_constraint(ThemeAnalysisPrompt)
+ReverseLogicalReasoningPrompt = bind_output_constraint(ReverseLogicalReasoningPrompt)
+FilterLogicalReasoningPrompt = bind_output_constraint(FilterLogicalReasoningPrompt)
+BlogExtractionPrompt = bind_output_constraint(BlogExtractionPrompt)
+HighlightExtractionPrompt = bind_output_constraint(HighlightExtractionPrompt)
+FinancialMarketAnalysisPrompt = bind_output_constraint(FinancialMarketAnalysisPrompt)
+ModelsAnalysisPrompt = bind_output_constraint(ModelsAnalysisPrompt)
+SubjectStandardizationPrompt = bind_output_constraint(SubjectStandardizationPrompt)
+UserInterestPrompt = bind_output_constraint(UserInterestPrompt)
+UserLogicPrompt = bind_output_constraint(UserLogicPrompt)
+BloggerPortraitPrompt = bind_output_constraint(BloggerPortraitPrompt)
+
+# 行情/板块分析结果缓存的最大条数（另按交易日清空）
+ANALYSIS_CACHE_SIZE = 64
+# 子主题标准化结果缓存的最大条数，调度进程长期运行，超出时淘汰最久未使用的条目
+SUBTOPICS_CACHE_SIZE = 1024
+# 子主题标准化时同时调用LLM的批次数
+SUBTOPICS_CONCURRENCY = 8
+
+
+def _lru_get(cache: OrderedDict, key: str):
+    """读取LRU缓存，命中时移到末尾，未命中返回None"""
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def _lru_put(cache: OrderedDict, key: str, value, max_size: int):
+    """写入LRU缓存，超出容量时淘汰最久未使用的条目"""
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
 
 class PostsProcessor:
     """历史发文处理逻辑"""
 
+    # 金融行情/板块分析结果缓存，按交易日失效
+    _analysis_cache: "OrderedDict[str, Dict]" = OrderedDict()
+    _analysis_cache_day: str = ""
+
     def __init__(self, type: str = "ReadMorning"):
         self.type = type
-        # 不再直接创建MongoDBService实例，而是使用数据库模型类
-        self.posts_db = PostsDB()
-        self.news_db = NewsDB()
+        # 使用共享的数据库模型和LLM服务实例，复用连接池
+        self.posts_db = get_posts_db()
+        self.news_db = get_news_db()
         self.event_processor = EventProcessor()
         # 使用posts_db实例中的mongodb连接
         self.mongodb = self.posts_db.mongodb
-        self.llm = LLMService()
+        self.llm = get_llm_service()
         self.task_mgr = TaskManager()
         self.now = datetime.now()
+        # 按(start_time, end_time)缓存时间窗口内的事件
+        self._events_cache: Dict[tuple, List[Dict]] = {}
 
     async def get_filtered_posts(self, posts: List[Dict]) -> List[Dict]:
         """过滤历史文章"""
@@ -135,13 +180,13 @@ class PostsProcessor:
         try:
             task_logger.info(f"开始执行市场分析: {post.get('md5')}")
 
-            full_prompt = ThemeAnalysisPrompt.format(posts=post, OutputFormatConstraint=OutputFormatConstraint)
+            full_prompt = ThemeAnalysisPrompt.format(posts=post)
             messages = [
                 {"role": "system", "content": ThemeAnalysisSystemPrompt},
                 {"role": "user", "content": full_prompt},
             ]
 
-            _, json_response = self.llm.call_llm(messages=messages)
+            _, json_response = self.llm.call_llm(messages=messages, json_mode=True)
 
             task_logger.info(f"市场分析完成: {post.get('md5')}")
             return json_response
@@ -149,21 +194,16 @@ class PostsProcessor:
             task_logger.error(f"市场分析失败: {str(e)}", exc_info=True)
             return {}
 
-    async def _analyze_user_logic(self, post: Dict) -> Dict:
-        """用户逻辑分析"""
-        try:
-            task_logger.info(f"开始执行用户逻辑分析: {post.get('md5')}")
-            end_time, start_time = calculate_base_time(
-                datetime.fromtimestamp(post["date"]), type=self.type
-            )
-            events = await self.news_db.get_news_selection_data(
-                start_time=start_time, end_time=end_time
-            )
-            if not events:
-                task_logger.info(
-                    f"没有找到{self.type}事件，跳过用户逻辑分析: {post.get('md5')}"
-                )
-                return None
+    async def _get_window_events(self, start_time: int, end_time: int) -> List[Dict]:
+        """获取时间窗口内过滤后的事件，同一窗口内的发文共享查询结果"""
+        key = (start_time, end_time)
+        if key in self._events_cache:
+            return self._events_cache[key]
+
+        events = await self.news_db.get_news_selection_data(
+            start_time=start_time, end_time=end_time
+        )
+        if events:
             events = await self.event_processor.get_filtered_events(events)
             events = [
                 {
@@ -176,23 +216,39 @@ class PostsProcessor:
                 }
                 for event in events
             ]
+        self._events_cache[key] = events
+        return events
+
+    async def _analyze_user_logic(self, post: Dict) -> Dict:
+        """用户逻辑分析"""
+        try:
+            task_logger.info(f"开始执行用户逻辑分析: {post.get('md5')}")
+            end_time, start_time = calculate_base_time(
+                datetime.fromtimestamp(post["date"]), type=self.type
+            )
+            events = await self._get_window_events(start_time, end_time)
+            if not events:
+                task_logger.info(
+                    f"没有找到{self.type}事件，跳过用户逻辑分析: {post.get('md5')}"
+                )
+                return None
             full_prompt1 = ReverseLogicalReasoningPrompt.format(
-                reference_text=post["mes"].strip(), count=len(events), data_list=events, OutputFormatConstraint=OutputFormatConstraint
+                reference_text=post["mes"].strip(), count=len(events), data_list=events
             )
             messages1 = [
                 {"role": "system", "content": ReverseLogicalReasoningSystemPrompt},
                 {"role": "user", "content": full_prompt1},
             ]
-            _, json_response1 = self.llm.call_llm(messages=messages1)
+            _, json_response1 = self.llm.call_llm(messages=messages1, json_mode=True)
 
             full_prompt2 = FilterLogicalReasoningPrompt.format(
-                candidate_news=events, selected_news=json_response1, OutputFormatConstraint=OutputFormatConstraint
+                candidate_news=events, selected_news=json_response1
             )
             messages2 = [
                 {"role": "system", "content": FilterLogicalReasoningSystemPrompt},
                 {"role": "user", "content": full_prompt2},
             ]
-            _, json_response2 = self.llm.call_llm(messages=messages2)
+            _, json_response2 = self.llm.call_llm(messages=messages2, json_mode=True)
             task_logger.info(f"用户逻辑分析完成: {post.get('md5')}")
             return json_response2
         except Exception as e:
@@ -203,12 +259,12 @@ class PostsProcessor:
         """内容提炼"""
         try:
             task_logger.info(f"开始执行内容分析: {post.get('md5')}")
-            full_prompt = BlogExtractionPrompt.format(post=post, OutputFormatConstraint=OutputFormatConstraint)
+            full_prompt = BlogExtractionPrompt.format(post=post)
             messages = [
                 {"role": "system", "content": BlogExtractionSystemPrompt},
                 {"role": "user", "content": full_prompt},
             ]
-            _, json_response = self.llm.call_llm(messages=messages)
+            _, json_response = self.llm.call_llm(messages=messages, json_mode=True)
             task_logger.info(f"内容提炼完成: {post.get('md5')}")
             return {"analyze_content": json_response}
         except Exception as e:
@@ -219,12 +275,12 @@ class PostsProcessor:
         """精华提炼"""
         try:
             task_logger.info(f"开始执行精华提炼: {post.get('md5')}")
-            full_prompt = HighlightExtractionPrompt.format(post=post, OutputFormatConstraint=OutputFormatConstraint)
+            full_prompt = HighlightExtractionPrompt.format(post=post)
             messages = [
                 {"role": "system", "content": HighlightExtractionSystemPrompt},
                 {"role": "user", "content": full_prompt},
             ]
-            _, json_response = self.llm.call_llm(messages=messages)
+            _, json_response = self.llm.call_llm(messages=messages, json_mode=True)
             task_logger.info(f"精华提炼完成: {post.get('md5')}")
 
             return {"analyze_content": json_response}
@@ -232,6 +288,22 @@ class PostsProcessor:
             task_logger.error(f"精华提炼失败: {str(e)}", exc_info=True)
             return {}
 
+    def _get_analysis_cache_key(
+        self, name: str, read_morning: List[Dict], logical_review: List[Dict]
+    ) -> str:
+        """根据分析类型和输入文章生成缓存键，跨交易日时清空缓存"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        if PostsProcessor._analysis_cache_day != today:
+            PostsProcessor._analysis_cache.clear()
+            PostsProcessor._analysis_cache_day = today
+        payload = json.dumps(
+            [name, read_morning, logical_review],
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
     async def financial_market_analysis(self, posts: dict = {}) -> Dict:
         """金融行情市场分析"""
         try:
@@ -241,14 +313,23 @@ class PostsProcessor:
                 task_logger.info("没有找到早间必读或逻辑复盘文章，跳过金融行情市场分析")
                 return {}
             task_logger.info("开始执行金融行情市场分析...")
+            key = self._get_analysis_cache_key(
+                "market", read_morning[:3], logical_review[:3]
+            )
+            cached = _lru_get(self._analysis_cache, key)
+            if cached is not None:
+                task_logger.info("命中缓存，直接返回分析结果")
+                return cached
             full_prompt = FinancialMarketAnalysisPrompt.format(
-                read_morning=read_morning[:3], logical_review=logical_review[:3], OutputFormatConstraint=OutputFormatConstraint
+                read_morning=read_morning[:3], logical_review=logical_review[:3]
             )
             messages = [
                 {"role": "system", "content": FinancialMarketAnalysisSystemPrompt},
                 {"role": "user", "content": full_prompt},
             ]
-            _, json_response = self.llm.call_llm(messages=messages)
+            _, json_response = self.llm.call_llm(messages=messages, json_mode=True)
+            if json_response:
+                _lru_put(self._analysis_cache, key, json_response, ANALYSIS_CACHE_SIZE)
             task_logger.info("金融行情市场分析完成")
             return json_response
         except Exception as e:
@@ -264,14 +345,23 @@ class PostsProcessor:
                 task_logger.info("没有找到早间必读或逻辑复盘文章，跳过金融板块分析")
                 return {}
             task_logger.info("开始执行金融板块分析...")
+            key = self._get_analysis_cache_key(
+                "models", read_morning[:3], logical_review[:3]
+            )
+            cached = _lru_get(self._analysis_cache, key)
+            if cached is not None:
+                task_logger.info("命中缓存，直接返回分析结果")
+                return cached
             full_prompt = ModelsAnalysisPrompt.format(
-                read_morning=read_morning[:3], logical_review=logical_review[:3], OutputFormatConstraint=OutputFormatConstraint
+                read_morning=read_morning[:3], logical_review=logical_review[:3]
             )
             messages = [
                 {"role": "system", "content": ModelsAnalysisSystemPrompt},
                 {"role": "user", "content": full_prompt},
             ]
-            _, json_response = self.llm.call_llm(messages=messages)
+            _, json_response = self.llm.call_llm(messages=messages, json_mode=True)
+            if json_response:
+                _lru_put(self._analysis_cache, key, json_response, ANALYSIS_CACHE_SIZE)
             task_logger.info("金融板块分析完成")
             return json_response
         except Exception as e:
@@ -354,44 +444,59 @@ class PostsService:
 class UserProfileProcessor:
     """用户画像处理"""
 
+    # 子主题标准化结果的LRU缓存，key为排序后子主题列表的sha256
+    _subtopics_cache: "OrderedDict[str, List[str]]" = OrderedDict()
+
     def __init__(self, type: str = "ReadMorning"):
         self.type = type
-        self.posts_db = PostsDB()
-        self.user_db = UserProfileDB()
+        self.posts_db = get_posts_db()
+        self.user_db = get_user_profile_db()
         self.mongodb = self.posts_db.mongodb
-        self.llm = LLMService()
+        self.llm = get_llm_service()
         self.task_mgr = TaskManager()
         self.now = datetime.now()
 
     async def _get_standardized_subtopics(self, sub_topics: List[str]) -> List[str]:
         """标准化子主题"""
         try:
-            full_prompt = SubjectStandardizationPrompt.format(sub_topics=sub_topics, OutputFormatConstraint=OutputFormatConstraint)
+            key = hashlib.sha256(
+                json.dumps(sorted(sub_topics), ensure_ascii=False).encode()
+            ).hexdigest()
+            cached = _lru_get(self._subtopics_cache, key)
+            if cached is not None:
+                return cached
+
+            full_prompt = SubjectStandardizationPrompt.format(sub_topics=sub_topics)
             messages = [
                 {"role": "system", "content": SubjectStandardizationSystemPrompt},
                 {"role": "user", "content": full_prompt},
             ]
-            _, json_response = self.llm.call_llm(messages=messages)
-            return [
+            # LLM调用会阻塞，在线程中执行，多个批次可以并发
+            _, json_response = await asyncio.to_thread(
+                self.llm.call_llm, messages=messages, json_mode=True
+            )
+            standardized = [
                 i["standardized_subtopic"]
                 for i in json_response["standardized_subtopics"]
             ]
+            _lru_put(self._subtopics_cache, key, standardized, SUBTOPICS_CACHE_SIZE)
+            return standardized
         except Exception as e:
             task_logger.error(f"标准化子主题失败: {str(e)}", exc_info=True)
             return {}
 
-    async def _get_topics(self, posts_analysis_df: pd.DataFrame) -> Dict:
+    async def _get_topics(self, posts_analysis: List[Dict]) -> Dict:
         """获取主题"""
         try:
-            coreMarketRankings = posts_analysis_df["coreMarketRankings"].tolist()
-            marketAnalysis = posts_analysis_df["marketAnalysis"].tolist()
             all_themes = []
-            for index, core in enumerate(coreMarketRankings):
+            for post_analysis in posts_analysis:
+                core = post_analysis.get("coreMarketRankings") or []
+                market_analysis = post_analysis.get("marketAnalysis") or []
                 core = set(
                     [
                         i
                         for i in (
-                            core + [d.get("theme", "") for d in marketAnalysis[index]]
+                            core + [d.get("theme", "") for d in market_analysis]
                         )
                         if i
                     ]
@@ -400,42 +505,38 @@ class UserProfileProcessor:
             all_themes = list(chain.from_iterable(all_themes))
             all_themes = Counter(all_themes)
 
-            # 构建主题词典
-            topics = {}
-            for index, data in enumerate(marketAnalysis):
-                for sub_topic in data:
+            # 构建主题词典，子主题使用集合在构建时去重
+            topics = defaultdict(lambda: {"frequency": 0, "subTopics": set()})
+            for post_analysis in posts_analysis:
+                for sub_topic in post_analysis.get("marketAnalysis") or []:
                     theme = sub_topic.get("theme", "")
                     if not theme:
                         continue
+                    topics[theme]["subTopics"].update(sub_topic.get("subTopics", []))
+            topics = dict(topics)
+            for theme in topics:
+                topics[theme]["frequency"] = all_themes[theme]
 
-                    if theme not in topics:
-                        topics[theme] = {
-                            "frequency": all_themes[theme],
-                            "subTopics": sub_topic.get("subTopics", []),
-                        }
-                    else:
-                        topics[theme]["subTopics"].extend(
-                            sub_topic.get("subTopics", [])
-                        )
-            # 子主题标准化处理
-            for topic in topics:
-                sub_topics_list = topics[topic]["subTopics"]
+            # 子主题标准化处理：所有主题的批次一起并发执行，限制同时调用LLM的批次数
+            semaphore = asyncio.Semaphore(SUBTOPICS_CONCURRENCY)
+
+            async def standardize(batch: List[str]) -> List[str]:
+                async with semaphore:
+                    return await self._get_standardized_subtopics(batch)
+
+            async def standardize_topic(topic: str):
+                # 排序保证批次稳定，可命中标准化缓存
+                sub_topics_list = sorted(topics[topic]["subTopics"])
                 # 将子主题列表分批处理，每批50个
-                sub_topics_list = [
+                batches = [
                     sub_topics_list[i : i + 50]
                     for i in range(0, len(sub_topics_list), 50)
                 ]
-                topics[topic]["subTopics"] = []
-
-                # 对每批子主题进行标准化处理
-                results = await self.task_mgr.process_tasks(
-                    self._get_standardized_subtopics,
-                    sub_topics_list,
-                    use_processes=False,
-                )
-                topics[topic]["subTopics"].extend(list(chain.from_iterable(results)))
+                results = await asyncio.gather(*(standardize(batch) for batch in batches))
                 # 去重处理
-                topics[topic]["subTopics"] = list(set(topics[topic]["subTopics"]))
+                topics[topic]["subTopics"] = list(set(chain.from_iterable(results)))
+
+            await asyncio.gather(*(standardize_topic(topic) for topic in topics))
             return topics
         except Exception as e:
             task_logger.error(f"获取主题失败: {str(e)}", exc_info=True)
@@ -444,87 +545,113 @@ class UserProfileProcessor:
     async def _get_user_topic_profile(self, topics: dict) -> Dict:
         """获取用户市场主题画像"""
         try:
-            full_prompt = UserInterestPrompt.format(topics=topics, OutputFormatConstraint=OutputFormatConstraint)
+            full_prompt = UserInterestPrompt.format(topics=topics)
             messages = [
                 {"role": "system", "content": UserInterestSystemPrompt},
                 {"role": "user", "content": full_prompt},
             ]
-            _, json_response = self.llm.call_llm(messages=messages)
+            _, json_response = await asyncio.to_thread(
+                self.llm.call_llm, messages=messages, json_mode=True
+            )
             return json_response["user_topic_profile"]
         except Exception as e:
             task_logger.error(f"获取用户画像失败: {str(e)}", exc_info=True)
             return {}
 
-    async def _get_user_logic_profile(self, posts_analysis_df: pd.DataFrame) -> Dict:
+    async def _get_user_logic_profile(self, posts_analysis: List[Dict]) -> Dict:
         """获取用户逻辑画像"""
         try:
-            filter_logics = posts_analysis_df["filter_logic"].tolist()
-            
-            # 统计None值数量
-            none_count = sum(1 for item in filter_logics if item is None)
-            total_count = len(filter_logics)
-            none_ratio = none_count / total_count if total_count > 0 else 0
-            
-            # 如果None值超过10%，不执行大模型生成
-            if none_ratio > 0.1:
-                task_logger.info(f"历史发文分析中None值比例过高({none_ratio:.2%})，跳过用户逻辑画像生成,从数据库中获取")
-                user_logic_profile = await self.user_db.get_logic_profile()
-                return user_logic_profile
-            
-            # 去除None值
-            valid_filter_logics = [logic for logic in filter_logics if logic is not None]
+            total_count = len(posts_analysis)
+            # None值超过10%时不执行大模型生成
+            max_none_count = total_count * 0.1
+
+            # 单次遍历去除None值，超过阈值时提前退出
+            none_count = 0
+            valid_filter_logics = []
+            for post_analysis in posts_analysis:
+                logic = post_analysis.get("filter_logic")
+                if logic is not None:
+                    valid_filter_logics.append(logic)
+                    continue
+                none_count += 1
+                if none_count > max_none_count:
+                    task_logger.info("历史发文分析中None值比例超过10%，跳过用户逻辑画像生成,从数据库中获取")
+                    user_logic_profile = await self.user_db.get_logic_profile()
+                    return user_logic_profile
             task_logger.info(f"过滤掉{none_count}个None值后，剩余{len(valid_filter_logics)}个有效逻辑记录")
             
             # 执行大模型生成
-            full_prompt = UserLogicPrompt.format(filter_logics=valid_filter_logics, OutputFormatConstraint=OutputFormatConstraint)
+            full_prompt = UserLogicPrompt.format(filter_logics=valid_filter_logics)
             messages = [
                 {"role": "system", "content": UserLogicSystemPrompt},
                 {"role": "user", "content": full_prompt},
             ]
-            _, json_response = self.llm.call_llm(messages=messages)
+            _, json_response = await asyncio.to_thread(
+                self.llm.call_llm, messages=messages, json_mode=True
+            )
 
             return json_response
         except Exception as e:
             task_logger.error(f"获取用户逻辑画像失败: {str(e)}", exc_info=True)
             return {}
 
-    async def _get_user_writing_style(self, posts: List[Dict] = []) -> Dict:
-        """获取用户写作风格"""
+    async def _get_user_writing_style(self, posts: List[Dict]) -> Dict:
+        """根据已获取的历史发文获取用户写作风格"""
         try:
-            if posts == []:
-                posts = await self.posts_db.get_posts(type=self.type, limit=20)
             if not posts:
                 task_logger.info("没有找到历史发文，跳过获取用户写作风格")
                 return {}
-            full_prompt = BloggerPortraitPrompt.format(posts=posts, OutputFormatConstraint=OutputFormatConstraint)
+            full_prompt = BloggerPortraitPrompt.format(posts=posts)
             messages = [
                 {"role": "system", "content": BloggerPortraitSystemPrompt},
                 {"role": "user", "content": full_prompt},
             ]
-            _, json_response = self.llm.call_llm(messages=messages)
+            _, json_response = await asyncio.to_thread(
+                self.llm.call_llm, messages=messages, json_mode=True
+            )
             return json_response["writing_style"]
 
         except Exception as e:
             task_logger.error(f"获取用户写作风格失败: {str(e)}", exc_info=True)
             return {}
 
-    async def extract_user_profile(self, posts_analysis: List[Dict] = []):
-        """提取用户画像"""
+    async def extract_user_profile(
+        self, posts_analysis: List[Dict] = [], posts: Optional[List[Dict]] = None
+    ):
+        """提取用户画像
+
+        Args:
+            posts_analysis: 历史发文分析结果，为空时从数据库获取
+            posts: 已获取的历史发文，用于写作风格分析，为None时从数据库获取一次
+        """
         try:
             task_logger.info("开始提取用户画像...")
+            # 分析结果和写作风格所需的历史发文只查询一次，两个查询并发执行；
+            # 调用方已提供的数据直接作为结果（asyncio.sleep(0, result) 立即返回result）
             if posts_analysis == []:
-                posts_analysis = await self.posts_db.get_posts_analysis(
-                    type=self.type, limit=100
-                )
+                analysis_query = self.posts_db.get_posts_analysis(type=self.type, limit=100)
+            else:
+                analysis_query = asyncio.sleep(0, posts_analysis)
+            if posts is None:
+                posts_query = self.posts_db.get_posts(type=self.type, limit=20)
+            else:
+                posts_query = asyncio.sleep(0, posts)
+            posts_analysis, posts = await asyncio.gather(analysis_query, posts_query)
             if not posts_analysis:
                 task_logger.info("没有找到历史发分析结果，跳过提取用户画像")
                 return {}
 
-            posts_analysis_df = pd.DataFrame(posts_analysis)
-            topics = await self._get_topics(posts_analysis_df)
-            user_topic_profile = await self._get_user_topic_profile(topics)
-            user_logic_profile = await self._get_user_logic_profile(posts_analysis_df)
-            writing_style = await self._get_user_writing_style()
+            topics = await self._get_topics(posts_analysis)
+            # 主题画像、逻辑画像与写作风格相互独立，并发执行
+            (
+                user_topic_profile,
+                user_logic_profile,
+                writing_style,
+            ) = await asyncio.gather(
+                self._get_user_topic_profile(topics),
+                self._get_user_logic_profile(posts_analysis),
+                self._get_user_writing_style(posts=posts[:20]),
+            )
             user_profile_data = {
                 "writing_style": writing_style,
                 "topics": topics,
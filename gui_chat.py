@@ -14,11 +14,30 @@ import asyncio
 from datetime import datetime
 import queue
 import webbrowser
+from contextlib import contextmanager
+from functools import partial
 
 # 添加项目路径
 project_root = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, project_root)
 
+# 聊天区域最多保留的行数，更早的内容只保留在导出记录中
+MAX_TRANSCRIPT_LINES = 2000
+
+# 侧边栏快捷问题 (按钮文字, 问题)
+QUICK_QUESTIONS = (
+    ("股市行情分析", "请帮我分析一下今天的股市行情"),
+    ("美债收益率", "什么是美债收益率？它对股市有什么影响？"),
+    ("VIX指数", "VIX指数是什么意思？"),
+    ("投资建议", "请给我一些投资理财的建议"),
+)
+
+# 示例问题
+EXAMPLE_QUESTIONS = tuple(question for _, question in QUICK_QUESTIONS) + (
+    "如何分析一只股票的基本面？",
+    "什么是技术分析？常用指标有哪些？",
+)
+
 class ChatGUI:
     def __init__(self):
         self.root = tk.Tk()
@@ -38,18 +57,54 @@ class ChatGUI:
         self.user_id = "gui_user"
         
         # 线程和队列
-        self.message_queue = queue.Queue()
+        self.message_queue = queue.Queue(maxsize=1024)
+        # 状态类消息只保留最新值，队列中最多有一个待处理的刷新请求
+        self._status_lock = threading.Lock()
+        self._latest_status = {}
+        self._refresh_pending = False
         self.is_thinking = False
+        # 窗口关闭后后台线程不再唤醒主线程
+        self._closing = False
+        
+        # 消息时间戳缓存（由update_time每秒刷新）及批量插入标记
+        self._time_str = datetime.now().strftime("%H:%M:%S")
+        self._last_time_str = ""
+        # _editable嵌套深度，仅最外层切换编辑状态
+        self._edit_depth = 0
+        
+        # 导出用的聊天记录，按行追加，导出时无需读取整个文本控件
+        self._export_log = []
+        # 正在流式输出的AI回复片段及其消息前缀，None 表示当前没有流式输出
+        self._stream_parts = None
+        self._stream_prefix = ""
+        
+        # 消息计数，避免统计时扫描整个聊天记录
+        self.user_msg_count = 0
+        self.ai_msg_count = 0
+        
+        # 常驻后台事件循环，所有聊天请求复用同一个循环
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        
+        # 后台预加载聊天服务模块（FAISS、向量模型等），与界面构建并行
+        threading.Thread(
+            target=lambda: __import__('services.chat_service'), daemon=True
+        ).start()
         
         # 初始化UI
         self.setup_ui()
         self.setup_chat_service()
         
-        # 启动消息处理循环
+        # 后台线程投递消息后通过虚拟事件唤醒处理，无需定时轮询
+        self.root.bind("<<MsgReady>>", lambda e: self.process_messages())
+        # 处理绑定前已入队的消息
         self.process_messages()
     
     def setup_ui(self):
         """设置用户界面"""
+        # 构建期间隐藏窗口，全部控件创建完后一次性完成布局和绘制
+        self.root.withdraw()
+        
         # 主框架
         main_frame = ttk.Frame(self.root, padding="10")
         main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -74,6 +129,8 @@ class ChatGUI:
         
         # 侧边栏（功能按钮）
         self.create_sidebar(main_frame)
+        
+        self.root.deiconify()
     
     def create_header(self, parent):
         """创建标题栏"""
@@ -146,6 +203,9 @@ class ChatGUI:
         
         # 输入框
         self.input_var = tk.StringVar()
+        # 输入变化时缓存去除首尾空白后的内容，发送时直接使用
+        self._pending_input = ""
+        self.input_var.trace_add('write', self._on_input_changed)
         self.input_entry = ttk.Entry(
             input_frame,
             textvariable=self.input_var,
@@ -192,14 +252,9 @@ class ChatGUI:
         # 快捷功能
         ttk.Label(sidebar_frame, text="快捷功能:", font=("Arial", 10, "bold")).pack(anchor=tk.W, pady=(0, 5))
         
-        ttk.Button(sidebar_frame, text="股市行情分析", 
-                  command=lambda: self.quick_question("请帮我分析一下今天的股市行情")).pack(fill=tk.X, pady=2)
-        ttk.Button(sidebar_frame, text="美债收益率", 
-                  command=lambda: self.quick_question("什么是美债收益率？它对股市有什么影响？")).pack(fill=tk.X, pady=2)
-        ttk.Button(sidebar_frame, text="VIX指数", 
-                  command=lambda: self.quick_question("VIX指数是什么意思？")).pack(fill=tk.X, pady=2)
-        ttk.Button(sidebar_frame, text="投资建议", 
-                  command=lambda: self.quick_question("请给我一些投资理财的建议")).pack(fill=tk.X, pady=2)
+        for label, question in QUICK_QUESTIONS:
+            ttk.Button(sidebar_frame, text=label, 
+                      command=partial(self.quick_question, question)).pack(fill=tk.X, pady=2)
         
         # 分隔线
         ttk.Separator(sidebar_frame, orient='horizontal').pack(fill=tk.X, pady=10)
@@ -235,35 +290,31 @@ class ChatGUI:
                 doc_count = stats.get('total_documents', 0)
                 
                 # 更新UI
-                self.message_queue.put(('status', 'ready', f"✅ 已连接 ({doc_count}个文档)"))
-                self.message_queue.put(('db_status', f"📚 {doc_count} 个文档"))
-                self.message_queue.put(('system', "聊天服务已就绪，您可以开始提问了！"))
+                self.post_message('status', 'ready', f"✅ 已连接 ({doc_count}个文档)")
+                self.post_message('db_status', f"📚 {doc_count} 个文档")
+                self.post_message('system', "聊天服务已就绪，您可以开始提问了！")
                 
             except Exception as e:
-                self.message_queue.put(('status', 'error', "❌ 初始化失败"))
-                self.message_queue.put(('error', f"初始化聊天服务失败: {str(e)}"))
+                self.post_message('status', 'error', "❌ 初始化失败")
+                self.post_message('error', f"初始化聊天服务失败: {str(e)}")
         
         # 在后台线程中初始化
         threading.Thread(target=init_service, daemon=True).start()
     
     def process_messages(self):
         """处理消息队列"""
+        # 一次性取出队列中的所有消息，整批只切换一次编辑状态
+        with self._editable():
+            self._drain_queue()
+    
+    def _drain_queue(self):
+        """取出并处理队列中的全部消息"""
         try:
             while True:
                 msg_type, *args = self.message_queue.get_nowait()
                 
-                if msg_type == 'status':
-                    status, text = args
-                    self.status_label.config(text=text)
-                    if status == 'ready':
-                        self.status_label.config(foreground="green")
-                    elif status == 'error':
-                        self.status_label.config(foreground="red")
-                    else:
-                        self.status_label.config(foreground="orange")
-                
-                elif msg_type == 'db_status':
-                    self.db_status_label.config(text=args[0])
+                if msg_type == 'refresh_status':
+                    self._refresh_status()
                 
                 elif msg_type == 'system':
                     self.add_system_message(args[0])
@@ -274,42 +325,134 @@ class ChatGUI:
                 elif msg_type == 'ai_response':
                     self.add_ai_message(args[0], args[1] if len(args) > 1 else False)
                     self.set_thinking(False)
+                    self.update_stats()
+                
+                elif msg_type == 'ai_chunk':
+                    self.append_ai_chunk(args[0])
+                
+                elif msg_type == 'ai_done':
+                    self.finish_ai_stream(args[0])
+                    self.set_thinking(False)
+                    self.update_stats()
                 
                 elif msg_type == 'thinking_done':
+                    # 流式输出中途失败时收尾已输出的部分
+                    self.finish_ai_stream(None)
                     self.set_thinking(False)
         
         except queue.Empty:
             pass
-        
-        # 继续处理
-        self.root.after(100, self.process_messages)
+    
+    @contextmanager
+    def _editable(self):
+        """允许编辑聊天区域，嵌套调用时只在最外层切换状态并滚动到底部"""
+        if self._edit_depth == 0:
+            self.chat_text.configure(state='normal')
+        self._edit_depth += 1
+        try:
+            yield
+        finally:
+            self._edit_depth -= 1
+            if self._edit_depth == 0:
+                self._trim_transcript()
+                self.chat_text.configure(state='disabled')
+                self.chat_text.see(tk.END)
+    
+    def _refresh_status(self):
+        """应用最新的状态消息"""
+        with self._status_lock:
+            latest_status = self._latest_status
+            self._latest_status = {}
+            self._refresh_pending = False
+        
+        if 'status' in latest_status:
+            status, text = latest_status['status']
+            self.status_label.config(text=text)
+            if status == 'ready':
+                self.status_label.config(foreground="green")
+            elif status == 'error':
+                self.status_label.config(foreground="red")
+            else:
+                self.status_label.config(foreground="orange")
+        
+        if 'db_status' in latest_status:
+            self.db_status_label.config(text=latest_status['db_status'][0])
+    
+    def post_message(self, msg_type, *args):
+        """从后台线程投递消息并唤醒主线程处理"""
+        if msg_type in ('status', 'db_status'):
+            with self._status_lock:
+                self._latest_status[msg_type] = args
+                if self._refresh_pending:
+                    return
+                self._refresh_pending = True
+            self.message_queue.put(('refresh_status',))
+        else:
+            self.message_queue.put((msg_type, *args))
+        if self._closing:
+            return
+        try:
+            self.root.event_generate("<<MsgReady>>", when="tail")
+        except (tk.TclError, RuntimeError):
+            # 窗口已销毁，或主线程尚未进入/已退出mainloop（RuntimeError: main thread is not in main loop）；
+            # 消息保留在队列中，由进入mainloop后的首次处理取出
+            pass
     
     def add_message(self, message, tag=None, timestamp=True):
         """添加消息到聊天区域"""
-        self.chat_text.configure(state='normal')
-        
-        if timestamp:
-            time_str = datetime.now().strftime("%H:%M:%S")
-            self.chat_text.insert(tk.END, f"[{time_str}] ")
-        
-        if tag:
-            self.chat_text.insert(tk.END, message + "\n", tag)
-        else:
-            self.chat_text.insert(tk.END, message + "\n")
-        
-        self.chat_text.configure(state='disabled')
-        self.chat_text.see(tk.END)
+        prefix = f"[{self._time_str}] " if timestamp else ""
+        tags = (tag,) if tag else ()
+        if tag != "thinking":
+            self._export_log.append(f"{prefix}{message}\n")
+        
+        with self._editable():
+            # 时间戳与消息通过一次insert调用写入
+            self.chat_text.insert(tk.END, prefix, (), message + "\n", tags)
+    
+    def _trim_transcript(self):
+        """聊天区域超过最大行数时删除最早的内容（完整记录保留在导出记录中）"""
+        line_count = int(self.chat_text.index('end-1c').split('.')[0])
+        excess = line_count - MAX_TRANSCRIPT_LINES
+        if excess > 0:
+            self.chat_text.delete("1.0", f"{excess + 1}.0")
     
     def add_user_message(self, message):
         """添加用户消息"""
+        self.user_msg_count += 1
         self.add_message(f"💬 您: {message}", "user")
     
     def add_ai_message(self, message, context_used=False):
         """添加AI消息"""
         context_info = "📚 基于历史文章" if context_used else "💭 基于一般知识"
+        self.ai_msg_count += 1
         self.add_message(f"🤖 AI: {message}", "ai")
         self.add_message(f"    {context_info}", "system", False)
     
+    def append_ai_chunk(self, chunk):
+        """追加流式AI回复片段，首个片段到达时创建消息行"""
+        if self._stream_parts is None:
+            self._stream_parts = []
+            self._stream_prefix = f"[{self._time_str}] 🤖 AI: "
+            with self._editable():
+                self.chat_text.insert(tk.END, self._stream_prefix, ("ai",), "\n", ())
+                # 标记位于换行符之前，后续片段插入到标记处
+                self.chat_text.mark_set("ai_stream_mark", "end-2c")
+        self._stream_parts.append(chunk)
+        with self._editable():
+            self.chat_text.insert("ai_stream_mark", chunk, ("ai",))
+    
+    def finish_ai_stream(self, context_used):
+        """结束流式AI回复；context_used 为 None 表示输出未正常完成"""
+        if self._stream_parts is None:
+            return
+        self._export_log.append(f"{self._stream_prefix}{''.join(self._stream_parts)}\n")
+        self._stream_parts = None
+        self.chat_text.mark_unset("ai_stream_mark")
+        self.ai_msg_count += 1
+        if context_used is not None:
+            context_info = "📚 基于历史文章" if context_used else "💭 基于一般知识"
+            self.add_message(f"    {context_info}", "system", False)
+    
     def add_system_message(self, message):
         """添加系统消息"""
         self.add_message(f"ℹ️ {message}", "system")
@@ -324,31 +467,39 @@ class ChatGUI:
         if thinking:
             self.send_button.config(state='disabled', text="思考中...")
             self.input_entry.config(state='disabled')
+            # 用标记记录思考消息的位置，结束时直接按标记删除
+            self.chat_text.mark_set("thinking_start", "end-1c")
+            self.chat_text.mark_gravity("thinking_start", tk.LEFT)
             self.add_message("🤔 AI正在思考...", "thinking")
+            self.chat_text.mark_set("thinking_end", "end-1c")
+            self.chat_text.mark_gravity("thinking_end", tk.LEFT)
             self.bottom_status_label.config(text="AI正在思考...")
         else:
             self.send_button.config(state='normal', text="发送")
             self.input_entry.config(state='normal')
             self.bottom_status_label.config(text="就绪")
             # 移除思考消息
-            self.chat_text.configure(state='normal')
-            content = self.chat_text.get("1.0", tk.END)
-            lines = content.split('\n')
-            if lines and "🤔 AI正在思考..." in lines[-2]:
-                # 删除最后的思考消息
-                self.chat_text.delete("end-2l", "end-1l")
-            self.chat_text.configure(state='disabled')
+            if "thinking_start" not in self.chat_text.mark_names():
+                return
+            with self._editable():
+                self.chat_text.delete("thinking_start", "thinking_end")
+                self.chat_text.mark_unset("thinking_start", "thinking_end")
+    
+    def _on_input_changed(self, *_):
+        """输入框内容变化回调"""
+        self._pending_input = self.input_var.get().strip()
     
     def send_message(self):
         """发送消息"""
         if self.is_thinking:
             return
         
-        message = self.input_var.get().strip()
+        message = self._pending_input
         if not message:
             return
         
         # 清空输入框
+        self._pending_input = ""
         self.input_var.set("")
         
         # 显示用户消息
@@ -362,41 +513,36 @@ class ChatGUI:
         # 设置思考状态
         self.set_thinking(True)
         
-        # 在后台线程中处理
-        def process_message():
-            try:
-                # 创建新的事件循环
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-                # 调用聊天服务
-                result = loop.run_until_complete(
-                    self.chat_service.chat(
-                        query=message,
-                        conversation_id=self.conversation_id,
-                        user_id=self.user_id
-                    )
-                )
-                
-                if "error" in result:
-                    self.message_queue.put(('error', result["error"]))
-                else:
-                    self.conversation_id = result["conversation_id"]
-                    answer = result.get("answer", "抱歉，我无法回答这个问题。")
-                    context_used = result.get("context_used", False)
-                    
-                    self.message_queue.put(('ai_response', answer, context_used))
-                    
-                    # 更新统计
-                    self.update_stats()
-                
-            except Exception as e:
-                self.message_queue.put(('error', f"处理消息时出错: {str(e)}"))
-            finally:
-                self.message_queue.put(('thinking_done',))
+        # 提交到后台事件循环处理
+        future = asyncio.run_coroutine_threadsafe(self._stream_chat(message), self._loop)
+        future.add_done_callback(self._on_chat_done)
+    
+    async def _stream_chat(self, message):
+        """以流式方式请求回答，逐段投递到消息队列（在后台事件循环线程中执行）"""
+        result = await self.chat_service.chat(
+            query=message,
+            conversation_id=self.conversation_id,
+            user_id=self.user_id,
+            stream=True
+        )
+        
+        if "error" in result:
+            self.post_message('error', result["error"])
+            return
         
-        # 启动后台线程
-        threading.Thread(target=process_message, daemon=True).start()
+        self.conversation_id = result["conversation_id"]
+        async for chunk in result["response"]:
+            self.post_message('ai_chunk', chunk)
+        self.post_message('ai_done', result.get("context_used", False))
+    
+    def _on_chat_done(self, future):
+        """聊天请求完成回调（在后台事件循环线程中执行）"""
+        try:
+            future.result()
+        except Exception as e:
+            self.post_message('error', f"处理消息时出错: {str(e)}")
+        finally:
+            self.post_message('thinking_done')
     
     def quick_question(self, question):
         """快速提问"""
@@ -406,23 +552,17 @@ class ChatGUI:
     def clear_chat(self):
         """清空对话"""
         if messagebox.askyesno("确认", "确定要清空对话记录吗？"):
-            self.chat_text.configure(state='normal')
-            self.chat_text.delete(1.0, tk.END)
-            self.chat_text.configure(state='disabled')
-            self.add_system_message("对话已清空")
+            with self._editable():
+                self.chat_text.delete(1.0, tk.END)
+                self._export_log.clear()
+                self.add_system_message("对话已清空")
             self.conversation_id = None
+            self.user_msg_count = 0
+            self.ai_msg_count = 0
+            self.update_stats()
     
     def show_examples(self):
         """显示示例问题"""
-        examples = [
-            "请帮我分析一下今天的股市行情",
-            "什么是美债收益率？它对股市有什么影响？",
-            "VIX指数是什么意思？",
-            "请给我一些投资理财的建议",
-            "如何分析一只股票的基本面？",
-            "什么是技术分析？常用指标有哪些？"
-        ]
-        
         example_window = tk.Toplevel(self.root)
         example_window.title("示例问题")
         example_window.geometry("400x300")
@@ -431,14 +571,19 @@ class ChatGUI:
         
         ttk.Label(example_window, text="点击问题快速提问:", font=("Arial", 12, "bold")).pack(pady=10)
         
-        for example in examples:
+        for example in EXAMPLE_QUESTIONS:
             btn = ttk.Button(
                 example_window, 
                 text=example,
-                command=lambda q=example: [example_window.destroy(), self.quick_question(q)]
+                command=partial(self._pick_example, example_window, example)
             )
             btn.pack(fill=tk.X, padx=20, pady=2)
     
+    def _pick_example(self, window, question):
+        """选择示例问题：关闭示例窗口并提问"""
+        window.destroy()
+        self.quick_question(question)
+    
     def export_chat(self):
         """导出对话"""
         try:
@@ -448,12 +593,11 @@ class ChatGUI:
                 filetypes=[("文本文件", "*.txt"), ("所有文件", "*.*")]
             )
             if filename:
-                content = self.chat_text.get(1.0, tk.END)
                 with open(filename, 'w', encoding='utf-8') as f:
                     f.write(f"金融学长AI聊天记录\n")
                     f.write(f"导出时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
                     f.write("=" * 50 + "\n\n")
-                    f.write(content)
+                    f.writelines(self._export_log)
                 messagebox.showinfo("成功", "对话记录已导出")
         except Exception as e:
             messagebox.showerror("错误", f"导出失败: {str(e)}")
@@ -523,20 +667,24 @@ class ChatGUI:
     
     def update_stats(self):
         """更新统计信息"""
-        # 这里可以添加更详细的统计逻辑
-        content = self.chat_text.get(1.0, tk.END)
-        message_count = content.count("💬 您:") + content.count("🤖 AI:")
+        message_count = self.user_msg_count + self.ai_msg_count
         self.stats_label.config(text=f"消息数: {message_count}")
     
     def update_time(self):
         """更新时间显示"""
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.time_label.config(text=current_time)
+        # 仅在显示内容变化时刷新控件
+        if current_time != self._last_time_str:
+            self._last_time_str = current_time
+            self._time_str = current_time[11:]
+            self.time_label.config(text=current_time)
         self.root.after(1000, self.update_time)
     
     def on_closing(self):
         """关闭窗口时的处理"""
         if messagebox.askokcancel("退出", "确定要退出聊天助手吗？"):
+            self._closing = True
+            self._loop.call_soon_threadsafe(self._loop.stop)
             self.root.destroy()
     
     def run(self):
@@ -546,6 +694,8 @@ class ChatGUI:
         # 绑定快捷键
         self.root.bind('<Control-l>', lambda e: self.clear_chat())
         
+        # 进入mainloop后先处理一次队列，取出mainloop启动前唤醒失败的消息
+        self.root.after_idle(self.process_messages)
         # 启动应用
         self.root.mainloop()
 
@@ -76,10 +76,10 @@ class InteractiveChatInterface:
         print("   - quit/exit: 退出程序")
         print()
     
-    def print_stats(self):
+    async def print_stats(self):
         """打印系统统计"""
         try:
-            stats = self.chat_service.get_service_stats()
+            stats = await self.chat_service.get_service_stats()
             print("\n📊 系统统计:")
             print("="*40)
             
@@ -99,10 +99,10 @@ class InteractiveChatInterface:
         except Exception as e:
             print(f"❌ 获取统计信息失败: {e}")
     
-    def clear_conversation(self):
+    async def clear_conversation(self):
         """清除当前对话"""
         if self.current_conversation_id:
-            success = self.chat_service.clear_conversation(
+            success = await self.chat_service.clear_conversation(
                 self.current_conversation_id, 
                 self.user_id
             )
@@ -178,7 +178,7 @@ class InteractiveChatInterface:
         # 检查数据库状态
         if not self.check_vector_database():
             print("\n是否继续？(y/n): ", end="")
-            if input().lower().strip() not in ['y', 'yes']:
+            if (await asyncio.to_thread(input)).lower().strip() not in ['y', 'yes']:
                 print("👋 再见！")
                 return
         
@@ -186,8 +186,8 @@ class InteractiveChatInterface:
         
         while True:
             try:
-                # 获取用户输入
-                user_input = input("\n💬 您: ").strip()
+                # 获取用户输入（在线程中等待输入，不阻塞事件循环）
+                user_input = (await asyncio.to_thread(input, "\n💬 您: ")).strip()
                 
                 if not user_input:
                     continue
@@ -200,10 +200,10 @@ class InteractiveChatInterface:
                     self.print_help()
                     continue
                 elif user_input.lower() == 'stats':
-                    self.print_stats()
+                    await self.print_stats()
                     continue
                 elif user_input.lower() == 'clear':
-                    self.clear_conversation()
+                    await self.clear_conversation()
                     continue
                 
                 # 发送消息
@@ -265,8 +265,9 @@ if __name__ == "__main__":
                 }
             ]
             
-            for doc in sample_docs:
-                doc_manager.add_document(**doc)
+            doc_manager.add_documents(
+                [(doc["doc_id"], doc["content"], doc["metadata"]) for doc in sample_docs]
+            )
             
             print("✅ 示例数据添加完成")
             
@@ -1,6 +1,13 @@
+import atexit
 import logging
 import os
-from logging.handlers import TimedRotatingFileHandler
+import queue
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
 
 from config.settings import LOG_CONFIG
 
@@ -8,30 +15,120 @@ from config.settings import LOG_CONFIG
 LOG_DIR = LOG_CONFIG.get("dir")
 LOG_LEVEL = LOG_CONFIG.get("level")
 LOG_FORMAT = LOG_CONFIG.get("format")
+os.makedirs(LOG_DIR, exist_ok=True)
+# 按大小切分的日志文件上限
+LOG_MAX_BYTES = 64 * 1024 * 1024
 
+# 日志格式未使用线程/进程字段，关闭后创建LogRecord时无需获取这些信息
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 
-def setup_logger(name, log_file):
-    """设置日志记录器"""
-    if not os.path.exists(LOG_DIR):
-        os.makedirs(LOG_DIR)
+# 所有处理器共享同一个格式化器
+_FORMATTER = logging.Formatter(LOG_FORMAT)
+# 按日志文件缓存文件处理器，同一文件只创建一个处理器
+_FILE_HANDLERS = {}
 
+
+class _DispatchHandler(logging.Handler):
+    """按日志记录器名称将日志分发到对应的文件处理器"""
+
+    def __init__(self):
+        super().__init__()
+        self.routes = {}
+
+    def handle(self, record):
+        for handler in self.routes.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+    def emit(self, record):
+        pass
+
+
+# 调用方只负责入队，实际的文件/控制台写入由后台监听线程完成
+_LOG_QUEUE = queue.Queue(-1)
+_QUEUE_HANDLER = QueueHandler(_LOG_QUEUE)
+_CONSOLE_HANDLER = logging.StreamHandler()
+_CONSOLE_HANDLER.setFormatter(_FORMATTER)
+_DISPATCH_HANDLER = _DispatchHandler()
+_LISTENER = QueueListener(
+    _LOG_QUEUE, _DISPATCH_HANDLER, _CONSOLE_HANDLER, respect_handler_level=True
+)
+_LISTENER.start()
+atexit.register(_LISTENER.stop)
+# fork出的子进程中没有监听线程，需要改为直接写入
+_USE_QUEUE = True
+
+
+def _use_direct_handlers():
+    """子进程中将队列处理器替换为实际的处理器"""
+    global _USE_QUEUE
+    _USE_QUEUE = False
+    for name, handlers in _DISPATCH_HANDLER.routes.items():
+        logger = logging.getLogger(name)
+        logger.removeHandler(_QUEUE_HANDLER)
+        for handler in handlers:
+            logger.addHandler(handler)
+        logger.addHandler(_CONSOLE_HANDLER)
+
+
+os.register_at_fork(after_in_child=_use_direct_handlers)
+
+
+def _get_file_handler(log_file, kind="timed"):
+    """获取日志文件对应的文件处理器，首次写入时才打开文件
+
+    kind="timed" 按天切分；kind="size" 按文件大小切分，
+    适用于写入频繁的日志，避免每条记录都做时间换算
+    """
+    file_handler = _FILE_HANDLERS.get(log_file)
+    if file_handler is None:
+        if kind == "size":
+            file_handler = RotatingFileHandler(
+                os.path.join(LOG_DIR, log_file),
+                maxBytes=LOG_MAX_BYTES,
+                backupCount=30,
+                delay=True,
+                encoding="utf-8",
+            )
+        else:
+            file_handler = TimedRotatingFileHandler(
+                os.path.join(LOG_DIR, log_file),
+                when="midnight",
+                interval=1,
+                backupCount=30,
+                delay=True,
+                utc=True,
+                encoding="utf-8",
+            )
+        file_handler.setFormatter(_FORMATTER)
+        _FILE_HANDLERS[log_file] = file_handler
+    return file_handler
+
+
+def setup_logger(name, log_file, kind="timed"):
+    """设置日志记录器
+
+    高频调用处请使用 logger.info("... %s", value) 形式传参，
+    日志级别被过滤时不会执行字符串格式化；
+    kind 为 "timed"（按天切分）或 "size"（按大小切分）
+    """
     logger = logging.getLogger(name)
     if logger.handlers:
         return logger
     logger.setLevel(LOG_LEVEL)
 
     # 文件处理器
-    file_handler = TimedRotatingFileHandler(
-        os.path.join(LOG_DIR, log_file), when="midnight", interval=1, backupCount=30
-    )
-    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
-
-    # 控制台处理器
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    file_handler = _get_file_handler(log_file, kind)
+    _DISPATCH_HANDLER.routes[name] = [file_handler]
 
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    if _USE_QUEUE:
+        logger.addHandler(_QUEUE_HANDLER)
+    else:
+        logger.addHandler(file_handler)
+        logger.addHandler(_CONSOLE_HANDLER)
 
     return logger
 
@@ -39,4 +136,4 @@ def setup_logger(name, log_file):
 # 创建不同的日志记录器
 api_logger = setup_logger("api", "api.log")
 task_logger = setup_logger("task", "task.log")
-token_logger = setup_logger("token", "token.log")
+token_logger = setup_logger("token", "token.log", kind="size")
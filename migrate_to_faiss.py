@@ -14,21 +14,87 @@ import sys
 import os
 import argparse
 import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional
 
+import numpy as np
+
 from logger import task_logger
-from models.database import PostsDB
+from models.database import BaseDBModel, PostsDB
 from services.vector_service import DocumentManager
 from tqdm import tqdm
 
+# 默认的编码并发数：使用一半的CPU核心
+DEFAULT_CONCURRENCY = max(1, (os.cpu_count() or 2) // 2)
+
+# 编码子进程中的模型实例，每个进程首次使用时加载
+_encode_model = None
+
+
+def _init_encode_worker():
+    """编码子进程初始化：每个进程只使用一个计算线程，避免进程间争抢CPU"""
+    import torch
+    torch.set_num_threads(1)
+
+
+def _encode_chunks(model_name: str, texts: List[str], encode_batch_size: int = 128) -> np.ndarray:
+    """在子进程中编码文本片段"""
+    global _encode_model
+    if _encode_model is None:
+        from sentence_transformers import SentenceTransformer
+        _encode_model = SentenceTransformer(model_name)
+    return _encode_model.encode(
+        texts, batch_size=encode_batch_size, convert_to_numpy=True, show_progress_bar=False
+    )
+
+
+def _default_batch_size() -> int:
+    """根据设备选择默认的迁移批次大小：GPU适合更大的批次"""
+    import torch
+    return 256 if torch.cuda.is_available() else 64
+
 
 class DifyToFaissMigrator:
     """Dify到FAISS的数据迁移器"""
     
-    def __init__(self):
+    TYPE_MAP = {
+        "Zaokan": "早间必读",
+        "Fupan": "逻辑复盘",
+        "Essence": "精华内容"
+    }
+    
+    def __init__(
+        self,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        force: bool = False,
+        batch_size: Optional[int] = None,
+        encode_batch_size: int = 128
+    ):
+        # 同时迁移的批次数量（消费者数量），同时也是编码进程数量
+        self.concurrency = concurrency
+        # 是否允许覆盖已存在的向量数据库
+        self.force = force
+        # 每批迁移的文章数量，未指定时按设备自动选择
+        self.batch_size = batch_size or _default_batch_size()
+        # 向量模型编码时的批次大小
+        self.encode_batch_size = encode_batch_size
+        task_logger.info(
+            f"迁移参数: concurrency={concurrency}, batch_size={self.batch_size}, "
+            f"encode_batch_size={encode_batch_size}"
+        )
+        # 向量编码是CPU密集型任务，放到独立进程中执行；
+        # 使用spawn避免在已加载torch的进程中fork
+        self.executor = ProcessPoolExecutor(
+            max_workers=concurrency,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_encode_worker,
+        )
         self.posts_db = PostsDB()
         self.doc_manager = DocumentManager()
+        # 已迁移的文档ID（向量数据库文档字典的键视图），迁移开始时获取
+        self._known_ids = set()
         self.migration_stats = {
             "total_posts": 0,
             "migrated_posts": 0,
@@ -37,13 +103,7 @@ class DifyToFaissMigrator:
         }
     
     async def get_migration_data(self) -> Dict[str, List]:
-        """获取需要迁移的数据"""
-        TYPE_MAP = {
-            "Zaokan": "早间必读",
-            "Fupan": "逻辑复盘",
-            "Essence": "精华内容"
-        }
-        
+        """获取需要迁移的数据（一次性加载，用于预览）"""
         migration_data = {
             "早间必读": [],
             "逻辑复盘": [],
@@ -52,17 +112,29 @@ class DifyToFaissMigrator:
         
         task_logger.info("正在获取迁移数据...")
         
-        for type_key, type_name in TYPE_MAP.items():
-            try:
-                posts = await self.posts_db.get_posts(type=type_key, limit=None)
+        # 各类型的查询互不依赖，并发执行
+        results = await asyncio.gather(
+            *(self.posts_db.get_posts(type=type_key, limit=None) for type_key in self.TYPE_MAP),
+            return_exceptions=True
+        )
+        
+        for type_name, posts in zip(self.TYPE_MAP.values(), results):
+            if isinstance(posts, Exception):
+                task_logger.error(f"获取 {type_name} 数据失败: {str(posts)}")
+                migration_data[type_name] = []
+            else:
                 migration_data[type_name] = posts
                 task_logger.info(f"获取到 {len(posts)} 篇 {type_name} 文章")
-            except Exception as e:
-                task_logger.error(f"获取 {type_name} 数据失败: {str(e)}")
-                migration_data[type_name] = []
         
         return migration_data
     
+    async def count_migration_posts(self) -> int:
+        """统计需要迁移的文章总数"""
+        counts = await asyncio.gather(
+            *(self.posts_db.count_posts(type=type_key) for type_key in self.TYPE_MAP)
+        )
+        return sum(counts)
+    
     def preview_migration(self, migration_data: Dict[str, List]) -> None:
         """预览迁移数据"""
         print("\n" + "="*60)
@@ -76,12 +148,18 @@ class DifyToFaissMigrator:
             print(f"📑 {post_type}: {count} 篇文章")
             
             if posts:
-                # 显示最新和最旧的文章信息
-                latest_post = max(posts, key=lambda x: x.get('time', 0))
-                oldest_post = min(posts, key=lambda x: x.get('time', 0))
+                # 显示最新和最旧的文章信息（一次遍历同时求最大和最小时间）
+                latest_post = oldest_post = posts[0]
+                latest_time = oldest_time = latest_post.get('time', 0)
+                for post in posts:
+                    post_time = post.get('time', 0)
+                    if post_time > latest_time:
+                        latest_time, latest_post = post_time, post
+                    elif post_time < oldest_time:
+                        oldest_time, oldest_post = post_time, post
                 
-                latest_date = datetime.fromtimestamp(latest_post.get('time', 0)).strftime('%Y-%m-%d')
-                oldest_date = datetime.fromtimestamp(oldest_post.get('time', 0)).strftime('%Y-%m-%d')
+                latest_date = datetime.fromtimestamp(latest_time).strftime('%Y-%m-%d')
+                oldest_date = datetime.fromtimestamp(oldest_time).strftime('%Y-%m-%d')
                 
                 print(f"   📅 时间范围: {oldest_date} ~ {latest_date}")
                 print(f"   📋 最新文章: {latest_post.get('title', '无标题')[:50]}...")
@@ -89,51 +167,38 @@ class DifyToFaissMigrator:
         print(f"\n📊 总计: {total_count} 篇文章需要迁移")
         print("="*60)
     
-    async def migrate_posts(self, migration_data: Dict[str, List], dry_run: bool = False) -> bool:
-        """迁移文章数据"""
-        if dry_run:
-            self.preview_migration(migration_data)
-            return True
-        
+    async def migrate_posts(self, total: int = None) -> bool:
+        """迁移文章数据
+
+        生产者从数据库按批次流式读取文章放入队列，多个消费者并发编码入库，
+        内存中只保留队列内的批次
+        """
         try:
             # 检查向量数据库是否已存在
-            if self.doc_manager.vector_service.index_exists() and not self.confirm_overwrite():
-                print("❌ 迁移已取消")
+            if self.doc_manager.vector_service.index_exists() and not self.force:
+                print("\n⚠️  检测到已存在的向量数据库，使用 --force 参数覆盖现有数据")
+                task_logger.info("向量数据库已存在且未指定 --force，迁移已取消")
                 return False
             
             # 开始迁移
             task_logger.info("开始迁移数据到FAISS向量数据库...")
-            
-            all_posts = []
-            for post_type, posts in migration_data.items():
-                for post in posts:
-                    post['type'] = post_type  # 添加类型标记
-                    all_posts.append(post)
-            
-            self.migration_stats["total_posts"] = len(all_posts)
+            self._known_ids = self.doc_manager.load_existing_ids()
             
             # 批量处理文章
-            batch_size = 50
             failed_posts = []
+            queue = asyncio.Queue(maxsize=self.concurrency * 2)
             
-            with tqdm(total=len(all_posts), desc="迁移进度") as pbar:
-                for i in range(0, len(all_posts), batch_size):
-                    batch = all_posts[i:i + batch_size]
-                    
-                    for post in batch:
-                        try:
-                            success = await self.migrate_single_post(post)
-                            if success:
-                                self.migration_stats["migrated_posts"] += 1
-                            else:
-                                self.migration_stats["failed_posts"] += 1
-                                failed_posts.append(post)
-                        except Exception as e:
-                            task_logger.error(f"迁移文章失败: {post.get('md5', 'unknown')} - {str(e)}")
-                            self.migration_stats["failed_posts"] += 1
-                            failed_posts.append(post)
-                        
-                        pbar.update(1)
+            with tqdm(total=total, desc="迁移进度") as pbar:
+                workers = [
+                    asyncio.create_task(self._migrate_worker(queue, pbar, failed_posts))
+                    for _ in range(self.concurrency)
+                ]
+                try:
+                    await self._produce_batches(queue, self.batch_size)
+                finally:
+                    for _ in workers:
+                        await queue.put(None)
+                    await asyncio.gather(*workers)
             
             # 保存向量数据库
             task_logger.info("正在保存向量数据库...")
@@ -147,51 +212,79 @@ class DifyToFaissMigrator:
         except Exception as e:
             task_logger.error(f"迁移过程中发生错误: {str(e)}")
             return False
+        finally:
+            self.executor.shutdown()
     
-    async def migrate_single_post(self, post: Dict) -> bool:
-        """迁移单篇文章"""
-        try:
+    async def _produce_batches(self, queue: asyncio.Queue, batch_size: int) -> None:
+        """按类型依次从数据库分批读取文章放入队列"""
+        for type_key, type_name in self.TYPE_MAP.items():
+            try:
+                async for posts in self.posts_db.iter_posts(type=type_key, batch_size=batch_size):
+                    # 同一批次的文章类型相同，随批次传递类型，无需逐篇写入
+                    self.migration_stats["total_posts"] += len(posts)
+                    await queue.put((type_name, posts))
+            except Exception as e:
+                task_logger.error(f"获取 {type_name} 数据失败: {str(e)}")
+    
+    async def _migrate_worker(self, queue: asyncio.Queue, pbar: tqdm, failed_posts: List[Dict]) -> None:
+        """从队列中取出批次进行迁移，收到 None 时结束"""
+        while (item := await queue.get()) is not None:
+            post_type, batch = item
+            try:
+                results = await self.migrate_batch(batch, post_type)
+            except Exception as e:
+                task_logger.error(f"迁移批次失败: {str(e)}")
+                results = [False] * len(batch)
+            
+            for post, success in zip(batch, results):
+                if success:
+                    self.migration_stats["migrated_posts"] += 1
+                else:
+                    self.migration_stats["failed_posts"] += 1
+                    failed_posts.append(post)
+            
+            pbar.update(len(batch))
+    
+    async def migrate_batch(self, batch: List[Dict], post_type: str = '未知类型') -> List[bool]:
+        """迁移一批同类型的文章，返回与输入顺序一致的迁移结果"""
+        items = []
+        for post in batch:
+            doc_id = post.get('md5', '')
+            
             # 检查是否已经存在
-            if self.doc_manager.document_exists(post.get('md5', '')):
+            if doc_id in self._known_ids:
                 self.migration_stats["skipped_posts"] += 1
-                return True
+                continue
             
             # 构造文档元数据
             metadata = {
-                "type": post.get('type', '未知类型'),
+                "type": post_type,
                 "date": post.get('time', 0),
-                "md5": post.get('md5', ''),
+                "md5": doc_id,
                 "title": post.get('title', ''),
                 "source": "migration_from_dify"
             }
-            
-            # 添加文档到向量数据库
-            success = self.doc_manager.add_document(
-                doc_id=post.get('md5', ''),
-                content=post.get('mes', ''),
-                metadata=metadata,
-                save_immediately=False  # 批量保存
-            )
-            
-            return success
-            
-        except Exception as e:
-            task_logger.error(f"迁移单篇文章失败: {str(e)}")
-            return False
-    
-    def confirm_overwrite(self) -> bool:
-        """确认是否覆盖已存在的数据"""
-        print("\n⚠️  检测到已存在的向量数据库")
-        print("继续操作将会覆盖现有数据。")
+            items.append((doc_id, post.get('mes', ''), metadata))
         
-        while True:
-            choice = input("是否继续? (y/n): ").lower().strip()
-            if choice in ['y', 'yes']:
-                return True
-            elif choice in ['n', 'no']:
-                return False
-            else:
-                print("请输入 y 或 n")
+        results = {}
+        if items:
+            vector_service = self.doc_manager.vector_service
+            results, prepared, all_chunks = vector_service.prepare_documents(items)
+            if prepared:
+                # 在编码进程池中生成向量
+                loop = asyncio.get_running_loop()
+                vectors = await loop.run_in_executor(
+                    self.executor, _encode_chunks, vector_service.model_name,
+                    all_chunks, self.encode_batch_size
+                )
+                # 写入索引，迁移结束后统一保存；HNSW插入需持有写锁，在线程中执行，不阻塞其他批次和数据读取
+                results = await asyncio.to_thread(
+                    vector_service.add_encoded_documents,
+                    prepared, vectors, results, save=False
+                )
+        
+        # 已存在而跳过的文章视为成功
+        return [results.get(post.get('md5', ''), True) for post in batch]
     
     def print_migration_stats(self, failed_posts: List[Dict]) -> None:
         """打印迁移统计信息"""
@@ -247,18 +340,52 @@ async def main():
         help='强制覆盖已存在的向量数据库'
     )
     
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help='同时迁移的批次数量，即编码进程数量（默认CPU核心数的一半）'
+    )
+    
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=None,
+        help='每批迁移的文章数量（默认GPU为256，CPU为64）'
+    )
+    
+    parser.add_argument(
+        '--encode-batch-size',
+        type=int,
+        default=128,
+        help='向量模型编码时的批次大小（默认128）'
+    )
+    
     args = parser.parse_args()
     
     # 创建迁移器
-    migrator = DifyToFaissMigrator()
+    migrator = DifyToFaissMigrator(
+        concurrency=args.concurrency,
+        force=args.force,
+        batch_size=args.batch_size,
+        encode_batch_size=args.encode_batch_size
+    )
     
     try:
         print("🚀 开始数据迁移流程...")
         
-        # 获取迁移数据
-        migration_data = await migrator.get_migration_data()
+        # 预览模式需要完整数据，一次性加载
+        if args.dry_run:
+            migration_data = await migrator.get_migration_data()
+            if not any(migration_data.values()):
+                print("❌ 没有找到可迁移的数据")
+                return
+            migrator.preview_migration(migration_data)
+            print("👀 预览完成。使用 --force 参数执行实际迁移。")
+            return
         
-        if not any(migration_data.values()):
+        total = await migrator.count_migration_posts()
+        if not total:
             print("❌ 没有找到可迁移的数据")
             return
         
@@ -268,15 +395,12 @@ async def main():
                 print("🗑️  强制模式: 清理现有向量数据库...")
                 migrator.doc_manager.vector_service.clear_all()
         
-        # 执行迁移
-        success = await migrator.migrate_posts(migration_data, dry_run=args.dry_run)
+        # 执行迁移，文章从数据库流式读取
+        success = await migrator.migrate_posts(total=total)
         
         if success:
-            if not args.dry_run:
-                print("✅ 迁移成功完成!")
-                print("\n🔄 现在可以停止并重启应用以使用新的向量数据库。")
-            else:
-                print("👀 预览完成。使用 --force 参数执行实际迁移。")
+            print("✅ 迁移成功完成!")
+            print("\n🔄 现在可以停止并重启应用以使用新的向量数据库。")
         else:
             print("❌ 迁移过程中出现错误")
             sys.exit(1)
@@ -288,6 +412,8 @@ async def main():
         print(f"❌ 迁移失败: {str(e)}")
         task_logger.error(f"迁移失败: {str(e)}")
         sys.exit(1)
+    finally:
+        BaseDBModel.close_connection()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,24 @@
+import asyncio
+import copy
 import hashlib
-from datetime import datetime
-from typing import Dict, List
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import AsyncIterator, Dict, List, Optional
 
 from pymongo import DESCENDING
 
 from config.settings import MONGODB_SETTINGS
 from logger import task_logger
-from services.mongodb import MongoDBService
+from services.mongodb import AsyncMongoDBService, MongoDBService
+
+
+def _generate_id(prefix: str = "") -> str:
+    """根据前缀和当前纳秒时间戳生成唯一ID"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(prefix.encode("utf-8"))
+    h.update(time.time_ns().to_bytes(8, "little"))
+    return h.hexdigest()
 
 
 class BaseDBModel:
@@ -19,6 +31,11 @@ class BaseDBModel:
             BaseDBModel._mongodb_service = MongoDBService()
         self.mongodb = BaseDBModel._mongodb_service
 
+    @property
+    def async_mongodb(self) -> AsyncMongoDBService:
+        """当前事件循环对应的异步MongoDB服务，需在协程中使用"""
+        return AsyncMongoDBService.for_current_loop()
+
     @classmethod
     def close_connection(cls):
         """
@@ -36,10 +53,24 @@ class BaseDBModel:
 class NewsDB(BaseDBModel):
     """新闻数据库"""
 
+    NewsDB = MONGODB_SETTINGS["collections"]["news"]
+    NewsSelectionDB = MONGODB_SETTINGS["collections"]["news_selections"]
+    _indexes_ensured = False
+
     def __init__(self):
         super().__init__()
-        self.NewsDB = MONGODB_SETTINGS["collections"]["news"]
-        self.NewsSelectionDB = MONGODB_SETTINGS["collections"]["news_selections"]
+        self._ensure_indexes()
+
+    def _ensure_indexes(self):
+        """创建按时间和按ID查询所需的索引，每个进程只执行一次"""
+        if NewsDB._indexes_ensured:
+            return
+        self.mongodb.create_index(self.NewsDB, [("timestamp", -1)], name="timestamp_idx")
+        self.mongodb.create_index(self.NewsSelectionDB, [("date", -1)], name="date_idx")
+        # 批量按ID查询（batch_fetch_by_ids）所需的索引
+        self.mongodb.create_index(self.NewsDB, [("md5", 1)], name="md5_idx")
+        self.mongodb.create_index(self.NewsSelectionDB, [("id", 1)], name="id_idx")
+        NewsDB._indexes_ensured = True
 
     async def get_news_by_id(self, news_id: str, limit: int = 1) -> Dict:
         """根据新闻id获取新闻"""
@@ -162,10 +193,8 @@ class NewsDB(BaseDBModel):
 class EventsArticleDB(BaseDBModel):
     """事件文章数据库"""
 
-    def __init__(self):
-        super().__init__()
-        self.EventsArticleDB = MONGODB_SETTINGS["collections"]["events_articles"]
-        self.EventComparisonDB = MONGODB_SETTINGS["collections"]["event_comparison"]
+    EventsArticleDB = MONGODB_SETTINGS["collections"]["events_articles"]
+    EventComparisonDB = MONGODB_SETTINGS["collections"]["event_comparison"]
 
     async def get_events_articles(self, type: str, limit: int = 10) -> List[Dict]:
         """获取事件文章"""
@@ -205,15 +234,13 @@ class EventsArticleDB(BaseDBModel):
 
     async def insert_events(self, events: List[Dict], type: str) -> bool:
         """插入事件"""
-        id = hashlib.md5(
-            (type + datetime.now().strftime("%Y-%m-%d %H:%M:%S")).encode()
-        ).hexdigest()
+        id = _generate_id(type)
         events_data = {
             "id": id,
             "events": events,
             "content": "",
             "type": type,
-            "create_time": int(datetime.now().timestamp()),
+            "create_time": int(time.time()),
         }
         result = self.mongodb.insert_document(
             collection_name=self.EventsArticleDB,
@@ -252,85 +279,82 @@ class EventsArticleDB(BaseDBModel):
 class UserProfileDB(BaseDBModel):
     """用户画像数据库"""
 
-    def __init__(self):
-        super().__init__()
-        self.UserProfileDB = MONGODB_SETTINGS["collections"]["user_profile"]
+    UserProfileDB = MONGODB_SETTINGS["collections"]["user_profile"]
 
-    async def get_writing_style(self) -> Dict:
-        """获取用户写作风格"""
-        projection = {
-            "_id": 0,
-            "writing_style": 1,
-        }
-        sorted_field = "create_time"
-        user_profile = self.mongodb.fetch_data(
+    # 用户画像查询缓存：{字段元组: (画像版本, 画像数据)}，保存/更新画像时清空
+    # 画像版本为最新画像的 (id, create_time)，其他进程写入新画像后版本变化，缓存随之失效
+    _profile_cache = {}
+
+    def _latest_profile_version(self) -> Optional[tuple]:
+        """只查询最新画像的ID和时间作为版本，不读取画像内容"""
+        latest = self.mongodb.fetch_data(
             collection_name=self.UserProfileDB,
-            projection=projection,
-            sort_field=sorted_field,
+            projection={"_id": 0, "id": 1, "create_time": 1},
+            sort_field="create_time",
+            limit=1,
         )
+        return (latest[0].get("id"), latest[0].get("create_time")) if latest else None
+
+    async def get_profile_fields(self, fields: List[str]) -> Optional[Dict]:
+        """一次查询获取最新用户画像的多个字段，无画像时返回None
+
+        返回缓存数据的副本，调用方修改返回值不会影响缓存
+        """
+        key = tuple(sorted(fields))
+        version = self._latest_profile_version()
+        cached = UserProfileDB._profile_cache.get(key)
+        if cached and cached[0] == version:
+            return copy.deepcopy(cached[1])
+
+        profile = None
+        if version is not None:
+            projection = {"_id": 0, **{field: 1 for field in fields}}
+            user_profile = self.mongodb.fetch_data(
+                collection_name=self.UserProfileDB,
+                projection=projection,
+                sort_field="create_time",
+                limit=1,
+            )
+            profile = user_profile[0] if user_profile else None
+
+        UserProfileDB._profile_cache[key] = (version, profile)
+        return copy.deepcopy(profile)
+
+    async def _get_profile_field(self, field: str) -> Optional[Dict]:
+        """获取最新用户画像的单个字段"""
+        profile = await self.get_profile_fields([field])
+        return profile.get(field, {}) if profile is not None else None
 
-        return user_profile[0].get("writing_style", {}) if user_profile else None
+    async def get_writing_style(self) -> Dict:
+        """获取用户写作风格"""
+        return await self._get_profile_field("writing_style")
 
     async def get_topics(self) -> Dict:
         """获取用户主题"""
-        projection = {
-            "_id": 0,
-            "topics": 1,
-        }
-        sorted_field = "create_time"
-        user_profile = self.mongodb.fetch_data(
-            collection_name=self.UserProfileDB,
-            projection=projection,
-            sort_field=sorted_field,
-        )
-
-        return user_profile[0].get("topics", {}) if user_profile else None
+        return await self._get_profile_field("topics")
 
     async def get_topic_profile(self) -> Dict:
         """获取用户主题市场画像"""
-        projection = {
-            "_id": 0,
-            "topic_profile": 1,
-        }
-        sorted_field = "create_time"
-        user_profile = self.mongodb.fetch_data(
-            collection_name=self.UserProfileDB,
-            projection=projection,
-            sort_field=sorted_field,
-        )
-
-        return user_profile[0].get("topic_profile", {}) if user_profile else None
+        return await self._get_profile_field("topic_profile")
 
     async def get_logic_profile(self) -> Dict:
         """获取用户逻辑画像"""
-        projection = {
-            "_id": 0,
-            "logic_profile": 1,
-        }
-        sorted_field = "create_time"
-        user_profile = self.mongodb.fetch_data(
-            collection_name=self.UserProfileDB,
-            projection=projection,
-            sort_field=sorted_field,
-        )
-
-        return user_profile[0].get("logic_profile", {}) if user_profile else None
+        return await self._get_profile_field("logic_profile")
 
     async def save_user_profile(self, profile_data: Dict) -> bool:
         """保存用户画像"""
         # 生成唯一ID
-        id = hashlib.md5(
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S").encode()
-        ).hexdigest()
+        id = _generate_id()
 
         # 构建保存数据
         profile_data["id"] = id
-        profile_data["create_time"] = int(datetime.now().timestamp())
+        profile_data["create_time"] = int(time.time())
 
         # 插入数据
         result = self.mongodb.insert_document(
             collection_name=self.UserProfileDB, document=profile_data
         )
+        UserProfileDB._profile_cache.clear()
 
         return result
 
@@ -338,47 +362,177 @@ class UserProfileDB(BaseDBModel):
         """更新用户画像"""
         query = {"id": id}
         update = {
-            "$set": {field: value, "create_time": int(datetime.now().timestamp())}
+            "$set": {field: value, "create_time": int(time.time())}
         }
         result = self.mongodb.update_document(
             collection_name=self.UserProfileDB,
             query=query,
             update=update,
         )
+        UserProfileDB._profile_cache.clear()
 
         return result
 
 
+class ChatHistoryDB(BaseDBModel):
+    """对话历史数据库，多个服务进程共享同一份对话历史"""
+
+    ChatHistoryDB = MONGODB_SETTINGS["collections"]["chat_history"]
+    # 对话最后一次更新后保留的时间（秒），过期由MongoDB的TTL索引自动清理
+    HISTORY_TTL = 86400
+    _indexes_ensured = False
+
+    def __init__(self):
+        super().__init__()
+        self._ensure_indexes()
+
+    def _ensure_indexes(self):
+        """创建对话键的唯一索引和过期清理的TTL索引，每个进程只执行一次"""
+        if ChatHistoryDB._indexes_ensured:
+            return
+        self.mongodb.create_index(
+            self.ChatHistoryDB, [("key", 1)], name="key_idx", unique=True
+        )
+        self.mongodb.create_index(
+            self.ChatHistoryDB,
+            [("updated_at", 1)],
+            name="updated_at_ttl_idx",
+            expireAfterSeconds=self.HISTORY_TTL,
+        )
+        ChatHistoryDB._indexes_ensured = True
+
+    async def get_messages(self, key: str) -> List[Dict]:
+        """获取对话的消息列表"""
+        result = await asyncio.to_thread(
+            self.mongodb.fetch_data,
+            collection_name=self.ChatHistoryDB,
+            query={"key": key},
+            projection={"_id": 0, "messages": 1},
+            limit=1,
+        )
+        return result[0].get("messages", []) if result else []
+
+    async def append_messages(
+        self, key: str, messages: List[Dict], max_messages: int
+    ) -> bool:
+        """追加消息并只保留最近 max_messages 条，同时刷新过期时间"""
+        update = {
+            "$push": {"messages": {"$each": messages, "$slice": -max_messages}},
+            "$set": {"updated_at": datetime.now(timezone.utc)},
+        }
+        return await asyncio.to_thread(
+            self.mongodb.update_document,
+            collection_name=self.ChatHistoryDB,
+            query={"key": key},
+            update=update,
+            upsert=True,
+        )
+
+    async def get_stats(self) -> tuple:
+        """统计未过期的对话数和消息总数"""
+        pipeline = [
+            {
+                "$group": {
+                    "_id": None,
+                    "conversations": {"$sum": 1},
+                    "messages": {"$sum": {"$size": "$messages"}},
+                }
+            }
+        ]
+        result = await asyncio.to_thread(
+            self.mongodb.aggregate, self.ChatHistoryDB, pipeline
+        )
+        if not result:
+            return 0, 0
+        return result[0]["conversations"], result[0]["messages"]
+
+    async def delete_messages(self, key: str) -> bool:
+        """删除对话历史"""
+        return await asyncio.to_thread(
+            self.mongodb.delete_document, self.ChatHistoryDB, {"key": key}
+        )
+
+
 class PostsDB(BaseDBModel):
     """历史发文数据库"""
 
+    PostsDB = MONGODB_SETTINGS["collections"]["posts"]
+    PostsAnalysisDB = MONGODB_SETTINGS["collections"]["posts_analysis"]
+    _indexes_ensured = False
+
     def __init__(self):
         super().__init__()
-        self.PostsDB = MONGODB_SETTINGS["collections"]["posts"]
-        self.PostsAnalysisDB = MONGODB_SETTINGS["collections"]["posts_analysis"]
+        self._ensure_indexes()
+
+    def _ensure_indexes(self):
+        """创建按类型查询并按日期排序所需的复合索引及按ID查询的索引，每个进程只执行一次"""
+        if PostsDB._indexes_ensured:
+            return
+        self.mongodb.create_index(
+            self.PostsDB, [("type", 1), ("date", -1)], name="type_date_idx"
+        )
+        # 批量按ID查询（batch_fetch_by_ids）所需的索引
+        self.mongodb.create_index(self.PostsDB, [("md5", 1)], name="md5_idx")
+        self.mongodb.create_index(self.PostsAnalysisDB, [("id", 1)], name="id_idx")
+        PostsDB._indexes_ensured = True
 
-    async def get_posts(self, type: str, limit: int = 20) -> List[Dict]:
-        """获取历史发文"""
+    async def get_posts(self, type: str, limit: int = 20, stream: bool = False) -> List[Dict]:
+        """获取历史发文，stream为True时返回异步游标，通过 async for 逐条获取"""
         query = {"type": type}
         projection = {"_id": 0, "mes": 1, "date": 1, "type": 1, "md5": 1}
         sorted_field = "date"
-        posts = self.mongodb.fetch_data(
+        # 异步查询不阻塞事件循环，多个类型的查询可以并发进行
+        posts = await self.async_mongodb.fetch_data(
             collection_name=self.PostsDB,
             query=query,
             projection=projection,
             sort_field=sorted_field,
             sort_order=DESCENDING,
             limit=limit,
+            stream=stream,
         )
 
         return posts
 
-    async def get_posts_by_ids(self, ids: List[str]) -> List[Dict]:
-        """根据id获取历史发文"""
-        posts = self.mongodb.batch_fetch_by_ids(
+    async def count_posts(self, type: str) -> int:
+        """统计指定类型的历史发文数量"""
+        return await asyncio.to_thread(
+            self.mongodb.count_documents,
+            collection_name=self.PostsDB,
+            query={"type": type},
+        )
+
+    async def iter_posts(self, type: str, batch_size: int = 500) -> AsyncIterator[List[Dict]]:
+        """按批次流式获取历史发文，每次返回一批，避免一次性加载全部数据"""
+        # motor游标按 batch_size 从服务器拉取，async for 不阻塞事件循环
+        cursor = await self.async_mongodb.fetch_data(
+            collection_name=self.PostsDB,
+            query={"type": type},
+            projection={"_id": 0, "mes": 1, "date": 1, "type": 1, "md5": 1},
+            sort_field="date",
+            sort_order=DESCENDING,
+            stream=True,
+        )
+        cursor.batch_size(batch_size)
+        try:
+            posts = []
+            async for post in cursor:
+                posts.append(post)
+                if len(posts) >= batch_size:
+                    yield posts
+                    posts = []
+            if posts:
+                yield posts
+        finally:
+            await cursor.close()
+
+    async def get_posts_by_ids(self, ids: List[str], projection: Dict = None) -> List[Dict]:
+        """根据id获取历史发文，projection为空时返回除_id外的全部字段"""
+        posts = await self.async_mongodb.batch_fetch_by_ids(
             collection_name=self.PostsDB,
             ids_field="md5",
             id_list=ids,
+            projection=projection,
         )
         return posts
 
@@ -398,9 +552,10 @@ class PostsDB(BaseDBModel):
             return False
 
         if "id" not in analysis_data:
-            # 生成唯一ID
-            id = hashlib.md5(
-                f"posts_analysis_{datetime.now().strftime('%Y-%m-%d')}".encode()
+            # 生成唯一ID（同一天生成的ID相同）
+            id = hashlib.blake2b(
+                f"posts_analysis_{time.strftime('%Y-%m-%d')}".encode(),
+                digest_size=16,
             ).hexdigest()
             analysis_data["id"] = id
 
@@ -445,10 +600,22 @@ class PostsDB(BaseDBModel):
 class MarketDB(BaseDBModel):
     """市场数据库"""
 
+    quotesDB = MONGODB_SETTINGS["collections"]["quotes"]
+    exponentDB = MONGODB_SETTINGS["collections"]["exponent"]
+    _indexes_ensured = False
+
     def __init__(self):
         super().__init__()
-        self.quotesDB = MONGODB_SETTINGS["collections"]["quotes"]
-        self.exponentDB = MONGODB_SETTINGS["collections"]["exponent"]
+        self._ensure_indexes()
+
+    def _ensure_indexes(self):
+        """创建按指数类型查询并按时间排序所需的复合索引，每个进程只执行一次"""
+        if MarketDB._indexes_ensured:
+            return
+        self.mongodb.create_index(
+            self.exponentDB, [("type", 1), ("time", -1)], name="type_time_idx"
+        )
+        MarketDB._indexes_ensured = True
 
     async def get_quotes(self) -> List[Dict]:
         """获取上证所数据"""
@@ -470,28 +637,49 @@ class MarketDB(BaseDBModel):
     async def get_exponent(self) -> List[Dict]:
         """获取指数数据"""
         exponents_types = ["000001.SH", "N225.GI", "IXIC.GI"]
+        # 一次聚合查询取出每种指数最新的一条数据
+        pipeline = [
+            {"$match": {"type": {"$in": exponents_types}}},
+            {"$sort": {"time": -1}},
+            {
+                "$group": {
+                    "_id": "$type",
+                    "open": {"$first": "$open"},
+                    "close": {"$first": "$close"},
+                    "changeRatio": {"$first": "$changeRatio"},
+                }
+            },
+        ]
+        latest = {
+            exponent["_id"]: exponent
+            for exponent in self.mongodb.aggregate(self.exponentDB, pipeline)
+        }
+
         exponents = {}
         for exponents_type in exponents_types:
-            query = {"type": exponents_type}
-            projection = {
-                "_id": 0,
-                "open": 1,
-                "close": 1,
-                "changeRatio": 1,
-                "time": 1,
-                "type": 1,
-            }
-            sort_field = "time"
-            exponent = self.mongodb.fetch_data(
-                collection_name=self.exponentDB,
-                query=query,
-                projection=projection,
-                sort_field=sort_field,
-            )
+            exponent = latest[exponents_type]
             exponents[exponents_type] = {
-                "open": exponent[0]["open"],
-                "close": exponent[0]["close"],
-                "changeRatio": round(exponent[0]["changeRatio"], 2),
+                "open": exponent["open"],
+                "close": exponent["close"],
+                "changeRatio": round(exponent["changeRatio"], 2),
             }
 
         return exponents
+
+
+@lru_cache(maxsize=1)
+def get_posts_db() -> PostsDB:
+    """获取共享的历史发文数据库实例"""
+    return PostsDB()
+
+
+@lru_cache(maxsize=1)
+def get_news_db() -> NewsDB:
+    """获取共享的新闻数据库实例"""
+    return NewsDB()
+
+
+@lru_cache(maxsize=1)
+def get_user_profile_db() -> UserProfileDB:
+    """获取共享的用户画像数据库实例"""
+    return UserProfileDB()
@@ -12,3 +12,8 @@ OutputFormatConstraint = """
 2. 所有引号(")、反斜杠(\\)和控制字符必须正确转义
 3. 直接返回有效的JSON对象
 """
+
+
+def bind_output_constraint(template: str) -> str:
+    """预先填充模板中的输出格式约束，调用时无需重复传入"""
+    return template.replace("{OutputFormatConstraint}", OutputFormatConstraint)
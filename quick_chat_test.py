@@ -111,8 +111,9 @@ async def test_chat_service():
             }
         ]
         
-        for doc in test_docs:
-            doc_manager.add_document(**doc)
+        doc_manager.add_documents(
+            [(doc["doc_id"], doc["content"], doc["metadata"]) for doc in test_docs]
+        )
         
         # 测试聊天
         result = await chat_service.chat(
@@ -168,8 +169,9 @@ async def interactive_chat():
                 }
             ]
             
-            for doc in sample_docs:
-                doc_manager.add_document(**doc)
+            doc_manager.add_documents(
+                [(doc["doc_id"], doc["content"], doc["metadata"]) for doc in sample_docs]
+            )
             print("✅ 示例数据添加完成")
         else:
             print(f"✅ 向量数据库包含 {doc_count} 个文档")
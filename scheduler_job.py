@@ -1,6 +1,6 @@
 import asyncio
 
-from apscheduler.executors.pool import ThreadPoolExecutor, ProcessPoolExecutor
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from tqdm import tqdm
@@ -14,12 +14,16 @@ from logger import task_logger
 from models.database import PostsDB
 # from services.dify_document import DifyDatasetAPI  # 已替换为向量服务
 
+
 # 配置执行器
 executors = {
-    "default": ThreadPoolExecutor(20),  # 增加线程池大小到20
-    "processpool": ProcessPoolExecutor(6),  # 添加进程池支持CPU密集型任务
+    # 任务以网络、数据库和LLM调用为主，在线程中执行即可，避免进程启动和重复加载模型的开销
+    "default": ThreadPoolExecutor(40),
 }
 
+# 历史发文处理任务中同时处理的类型数
+POSTS_JOB_CONCURRENCY = 4
+
 job_defaults = {
     "coalesce": True,  # 错过的任务只运
     "max_instances": 1,  # 同一个任务同时只能有一个实例
@@ -45,13 +49,22 @@ def process_news_job(type: str = "Job"):
 
 def process_posts_job():
     """历史发文处理定时任务"""
-    try:
-        for type in TYPE_MAP.keys():
+
+    async def _extract(type: str, semaphore: asyncio.Semaphore):
+        async with semaphore:
             limit = None if type == "Essence" else 100
             task_logger.info(f"开始执行{TYPE_MAP[type]}历史发文处理任务...")
             posts_processor = PostsProcessor(type=type)
-            asyncio.run(posts_processor.extract_posts(limit=limit))
+            await posts_processor.extract_posts(limit=limit)
             task_logger.info(f"{TYPE_MAP[type]}历史发文处理任务完成")
+
+    async def _run_all():
+        # 各类型的处理以数据库和LLM调用为主，并发执行；限制并发数避免触发接口限流
+        semaphore = asyncio.Semaphore(POSTS_JOB_CONCURRENCY)
+        await asyncio.gather(*(_extract(type, semaphore) for type in TYPE_MAP.keys()))
+
+    try:
+        asyncio.run(_run_all())
     except Exception as e:
         task_logger.error(f"历史发文处理任务失败: {str(e)}", exc_info=True)
 
@@ -78,32 +91,44 @@ def article_generate_job(type: str = "ReadMorning"):
         event_processor = EventProcessor(type=type)
         asyncio.run(event_processor.generate_events())
         task_logger.info("事件处理任务完成")
-        # 生成文章
-        for i in range(3):
-            article_service = ArticleService(type)
-            article = asyncio.run(article_service.generate_article())
-            if article:
-                # 发送消息
-                asyncio.run(article_service.send_feishu_message(article))
+        # 生成文章，三篇并发生成
+        asyncio.run(_generate_and_send_articles(type, 3))
 
         task_logger.info("文章生成定时任务完成")
     except Exception as e:
         task_logger.error(f"文章生成定时任务失败: {str(e)}", exc_info=True)
 
 
+async def _generate_and_send_articles(type: str, count: int):
+    """并发生成多篇文章并逐篇发送消息"""
+    services = [ArticleService(type) for _ in range(count)]
+    articles = await asyncio.gather(
+        *(article_service.generate_article() for article_service in services)
+    )
+    for article_service, article in zip(services, articles):
+        if article:
+            # 发送消息
+            await article_service.send_feishu_message(article)
+
+
 def update_vector_document_job():
     """更新向量数据库文档定时任务"""
     try:
-        from services.vector_service import DocumentManager
+        from services.vector_service import get_document_manager
         
         task_logger.info("开始执行向量数据库更新任务...")
         
-        # 创建文档管理器
-        doc_manager = DocumentManager()
+        # 获取进程内共享的文档管理器
+        doc_manager = get_document_manager()
         
         # 同步所有类型的帖子到向量数据库
         asyncio.run(doc_manager.sync_posts_to_vector())
         
+        # 旧版本保存的索引类型不同时重建一次
+        if doc_manager.vector_service.index_outdated():
+            task_logger.info("向量索引类型已变更，开始重建索引...")
+            doc_manager.vector_service.rebuild_index()
+        
         # 获取统计信息
         stats = doc_manager.vector_service.get_stats()
         task_logger.info(f"向量数据库统计: {stats}")
@@ -121,7 +146,7 @@ def init_scheduler():
         process_news_job,
         CronTrigger(hour="*/2"),
         id="process_news_job",
-        executor="processpool",
+        executor="default",
     )
 
     # 历史发文处理（在奇数小时执行：1,3,5,7...）
@@ -129,7 +154,7 @@ def init_scheduler():
         process_posts_job,
         CronTrigger(hour="1/2"),
         id="process_posts_job",
-        executor="processpool",
+        executor="default",
     )
 
     # 用户画像生成（每天凌晨00:01）
@@ -137,7 +162,7 @@ def init_scheduler():
         user_profile_job,
         CronTrigger(hour=0, minute=1),
         id="user_profile_job",
-        executor="processpool",
+        executor="default",
     )
 
     # 早间必读（早7点）
@@ -145,7 +170,7 @@ def init_scheduler():
         article_generate_job,
         CronTrigger(hour=7, minute=1),
         id="event_integration_morning",
-        executor="processpool",
+        executor="default",
         args=["ReadMorning"],
     )
 
@@ -154,7 +179,7 @@ def init_scheduler():
         article_generate_job,
         CronTrigger(hour=14, minute=1),
         id="event_integration_afternoon",
-        executor="processpool",
+        executor="default",
         args=["LogicalReview"],
     )
 
@@ -163,13 +188,13 @@ def init_scheduler():
         update_vector_document_job,
         CronTrigger(hour=8, minute=1),
         id="update_vector_document_job_morning",
-        executor="processpool",
+        executor="default",
     )
     scheduler.add_job(
         update_vector_document_job,
         CronTrigger(hour=15, minute=1),
         id="update_vector_document_job_afternoon",
-        executor="processpool",
+        executor="default",
     )
 
 
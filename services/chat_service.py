@@ -1,5 +1,6 @@
-import json
+import asyncio
 import os
+from collections import OrderedDict
 from typing import List, Dict, Optional, AsyncGenerator
 from datetime import datetime
 
@@ -7,9 +8,16 @@ from datetime import datetime
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 from logger import task_logger
+from models.database import ChatHistoryDB
 from services.vector_service import DocumentManager
-from services.llm import LLMService
+from services.llm import get_llm_service
 from services.deepseek_processor import DeepSeekProcessor
+from services.semantic_cache import SemanticCache
+
+# 每个对话最多保留的消息条数
+MAX_HISTORY_MESSAGES = 20
+# RAG上下文缓存的最大条数
+RAG_CONTEXT_CACHE_SIZE = 512
 
 
 class LocalChatService:
@@ -17,22 +25,61 @@ class LocalChatService:
     
     def __init__(self):
         self.doc_manager = DocumentManager()
-        self.llm = LLMService()
-        self.conversation_history = {}  # 存储对话历史
+        self.llm = get_llm_service()
+        # 对话历史存储在MongoDB中，多个服务进程共享，长时间不活跃的对话自动过期
+        self.history_db = ChatHistoryDB()
+        # 相似问题的回答缓存，与向量服务共用同一个向量模型
+        vector_service = self.doc_manager.vector_service
+        self.semantic_cache = SemanticCache(
+            vector_service.embeddings, vector_dim=vector_service.vector_dim
+        )
+        # 按检索结果缓存已渲染的RAG上下文，索引变化（文档数变化或重建）后整体失效
+        self._context_cache = OrderedDict()
+        self._context_cache_generation = None
         
     def _generate_conversation_id(self) -> str:
         """生成对话ID"""
         return f"conv_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{hash(datetime.now()) % 10000}"
     
-    def _build_rag_context(self, query: str, k: int = 3) -> str:
-        """构建RAG上下文"""
+    async def _get_history(self, conversation_key: str) -> List[Dict]:
+        """获取对话历史"""
+        return await self.history_db.get_messages(conversation_key)
+    
+    async def _record_turn(self, conversation_key: str, query: str, answer: str):
+        """追加一轮问答到对话历史，只保留最近的消息"""
+        messages = [
+            {"role": "user", "content": query},
+            {"role": "assistant", "content": answer},
+        ]
+        await self.history_db.append_messages(conversation_key, messages, MAX_HISTORY_MESSAGES)
+    
+    async def _build_rag_context(self, query: str, k: int = 3, query_vector=None) -> str:
+        """构建RAG上下文，传入已编码的查询向量时检索不再重复编码"""
         try:
-            # 搜索相关文档
-            results = self.doc_manager.search_related_posts(query=query, k=k)
+            # 搜索相关文档（并发请求的检索会被合并批量执行）
+            results = await self.doc_manager.asearch_related_posts(
+                query=query, k=k, query_vector=query_vector
+            )
             
             if not results:
                 return "没有找到相关的历史文章参考。"
             
+            # 相似问题常检索到相同的文档片段，直接复用已渲染的上下文
+            index = self.doc_manager.vector_service.index
+            generation = (id(index), index.ntotal)
+            if generation != self._context_cache_generation:
+                self._context_cache.clear()
+                self._context_cache_generation = generation
+            
+            key = tuple(
+                (result["doc_id"], round(result["score"], 3), result.get("chunk_hit"))
+                for result in results
+            )
+            context = self._context_cache.get(key)
+            if context is not None:
+                self._context_cache.move_to_end(key)
+                return context
+            
             context_parts = []
             for i, result in enumerate(results, 1):
                 metadata = result.get("metadata", {})
@@ -50,7 +97,11 @@ class LocalChatService:
                     f"内容片段: {result.get('chunk_hit', result['content'][:300])}...\n"
                 )
             
-            return "\n".join(context_parts)
+            context = "\n".join(context_parts)
+            self._context_cache[key] = context
+            if len(self._context_cache) > RAG_CONTEXT_CACHE_SIZE:
+                self._context_cache.popitem(last=False)
+            return context
             
         except Exception as e:
             task_logger.error(f"构建RAG上下文失败: {str(e)}")
@@ -109,18 +160,55 @@ class LocalChatService:
             
             # 获取对话历史
             conversation_key = f"{user_id}_{conversation_id}"
-            history = self.conversation_history.get(conversation_key, [])
+            history = await self._get_history(conversation_key)
+            
+            # 相似问题命中缓存时直接复用回答，跳过检索和LLM调用
+            # 缓存键只有查询向量，回答依赖对话历史的追问（如"展开说说"）不读写缓存
+            # 向量编码、检索和LLM调用都是阻塞操作，放到线程中执行，不阻塞事件循环
+            # 查询向量只编码一次，缓存查找和RAG检索共用
+            cacheable = not history
+            query_vector = await asyncio.to_thread(self.semantic_cache.encode, query)
+            cached = self.semantic_cache.lookup(query_vector) if cacheable else None
+            if cached:
+                answer, context_used = cached
+                if stream:
+                    return {
+                        "conversation_id": conversation_id,
+                        "response": self._replay_cached_answer(
+                            answer, query, conversation_key
+                        ),
+                        "context_used": context_used,
+                        "stream": True
+                    }
+                # 缓存中保存的是未格式化的回答，非流式返回前统一格式化
+                answer = await asyncio.to_thread(
+                    DeepSeekProcessor.format_financial_answer, answer, context_used
+                )
+                await self._record_turn(conversation_key, query, answer)
+                return {
+                    "conversation_id": conversation_id,
+                    "answer": answer,
+                    "context_used": context_used,
+                    "stream": False,
+                    "message_id": f"msg_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{hash(answer) % 10000}"
+                }
             
             # 构建RAG上下文
-            context = self._build_rag_context(query)
+            context = await self._build_rag_context(query, query_vector=query_vector)
             
             # 构建聊天提示词
             messages = self._build_chat_prompt(query, context, history)
             
             # 调用LLM
             if stream:
-                # TODO: 实现流式响应
-                response = await self._generate_streaming_response(messages)
+                # 返回异步生成器，由调用方逐段消费；生成结束后写入对话历史
+                response = self._generate_streaming_response(
+                    messages,
+                    query,
+                    conversation_key,
+                    query_vector if cacheable else None,
+                    len(context) > 50,
+                )
                 return {
                     "conversation_id": conversation_id,
                     "response": response,
@@ -128,22 +216,24 @@ class LocalChatService:
                     "stream": True
                 }
             else:
-                think_response, json_response = self.llm.call_llm(messages=messages)
-                
-                # 使用DeepSeek处理器提取和清理答案
-                answer = DeepSeekProcessor.extract_answer(think_response, json_response)
+                think_response, json_response = await asyncio.to_thread(
+                    self.llm.call_llm, messages=messages
+                )
                 
-                # 验证答案质量
-                if not DeepSeekProcessor.validate_answer(answer):
-                    answer = "抱歉，我暂时无法为您提供满意的回答。请尝试重新表述您的问题。"
-                else:
-                    # 格式化金融相关答案
-                    answer = DeepSeekProcessor.format_financial_answer(answer, len(context) > 50)
+                # 答案的提取、清理和格式化同样在线程中执行，不阻塞事件循环
+                answer, valid = await asyncio.to_thread(
+                    self._extract_valid_answer, think_response, json_response
+                )
+                if valid:
+                    # 缓存清理后、格式化前的回答，与流式接口写入的形式一致
+                    if cacheable:
+                        self.semantic_cache.add(query_vector, answer, len(context) > 50)
+                    answer = await asyncio.to_thread(
+                        DeepSeekProcessor.format_financial_answer, answer, len(context) > 50
+                    )
                 
                 # 更新对话历史
-                history.append({"role": "user", "content": query})
-                history.append({"role": "assistant", "content": answer})
-                self.conversation_history[conversation_key] = history
+                await self._record_turn(conversation_key, query, answer)
                 
                 return {
                     "conversation_id": conversation_id,
@@ -176,26 +266,51 @@ class LocalChatService:
                 "timestamp": datetime.now().isoformat()
             }
     
-    async def _generate_streaming_response(self, messages: List[Dict]) -> AsyncGenerator[str, None]:
-        """生成流式响应（占位符，需要根据具体LLM实现）"""
-        # 这里需要根据具体的LLM服务实现流式响应
-        # 暂时返回普通响应
-        think_response, json_response = self.llm.call_llm(messages=messages)
+    @staticmethod
+    def _extract_valid_answer(think_response, json_response):
+        """提取并验证LLM回答，返回 (清理后的回答, 是否为有效回答)"""
+        # 使用DeepSeek处理器提取和清理答案
+        answer = DeepSeekProcessor.extract_answer(think_response, json_response)
         
-        if json_response and "content" in json_response:
-            answer = json_response["content"]
-        else:
-            answer = think_response if think_response else "抱歉，我无法处理您的请求。"
+        # 验证答案质量
+        if not DeepSeekProcessor.validate_answer(answer):
+            return "抱歉，我暂时无法为您提供满意的回答。请尝试重新表述您的问题。", False
+        return answer, True
+    
+    async def _replay_cached_answer(
+        self, answer: str, query: str, conversation_key: str
+    ) -> AsyncGenerator[str, None]:
+        """以流式接口返回缓存的回答"""
+        yield answer
+        await self._record_turn(conversation_key, query, answer)
+    
+    async def _generate_streaming_response(
+        self,
+        messages: List[Dict],
+        query: Optional[str] = None,
+        conversation_key: Optional[str] = None,
+        query_vector=None,
+        context_used: bool = False
+    ) -> AsyncGenerator[str, None]:
+        """生成流式响应，LLM返回的文本片段到达后立即输出"""
+        parts = []
+        async for chunk in self.llm.astream_llm(messages):
+            parts.append(chunk)
+            yield chunk
         
-        # 模拟流式输出
-        words = answer.split()
-        for i, word in enumerate(words):
-            if i == 0:
-                yield word
-            else:
-                yield f" {word}"
+        # 生成结束后统一清理，用于缓存和对话历史
+        answer = await asyncio.to_thread(DeepSeekProcessor.clean_content, "".join(parts))
+        if DeepSeekProcessor.validate_answer(answer) and query_vector is not None:
+            self.semantic_cache.add(query_vector, answer, context_used)
+        if not answer:
+            answer = "抱歉，我无法处理您的请求。"
+            yield answer
+        
+        # 更新对话历史
+        if conversation_key is not None:
+            await self._record_turn(conversation_key, query, answer)
     
-    def get_conversation_history(
+    async def get_conversation_history(
         self, 
         conversation_id: str, 
         user_id: str = "default_user",
@@ -203,7 +318,7 @@ class LocalChatService:
     ) -> List[Dict]:
         """获取对话历史"""
         conversation_key = f"{user_id}_{conversation_id}"
-        history = self.conversation_history.get(conversation_key, [])
+        history = await self._get_history(conversation_key)
         
         # 转换为消息格式
         messages = []
@@ -218,13 +333,10 @@ class LocalChatService:
         
         return messages[-limit:]
     
-    def clear_conversation(self, conversation_id: str, user_id: str = "default_user") -> bool:
+    async def clear_conversation(self, conversation_id: str, user_id: str = "default_user") -> bool:
         """清除对话历史"""
         conversation_key = f"{user_id}_{conversation_id}"
-        if conversation_key in self.conversation_history:
-            del self.conversation_history[conversation_key]
-            return True
-        return False
+        return await self.history_db.delete_messages(conversation_key)
     
     def feedback_message(
         self, 
@@ -242,10 +354,9 @@ class LocalChatService:
             "rating": rating
         }
     
-    def get_service_stats(self) -> Dict:
+    async def get_service_stats(self) -> Dict:
         """获取服务统计信息"""
-        total_conversations = len(self.conversation_history)
-        total_messages = sum(len(hist) for hist in self.conversation_history.values())
+        total_conversations, total_messages = await self.history_db.get_stats()
         vector_stats = self.doc_manager.vector_service.get_stats()
         
         return {
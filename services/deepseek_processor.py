@@ -6,13 +6,45 @@ DeepSeek-R1 输出处理器
 """
 
 import re
-import json
+from collections import deque
+from functools import lru_cache
 from typing import Tuple, Optional
 
+# str.translate 删除表：除制表符、换行符、回车符外的控制字符
+_CTRL_DROP = dict.fromkeys([i for i in range(32) if i not in (9, 10, 13)], None)
+# str.translate 删除表：代理对字符
+_SURROGATE_DROP = dict.fromkeys(range(0xD800, 0xE000), None)
+# 提取JSON文本内容时的最大嵌套深度
+_MAX_EXTRACT_DEPTH = 3
+
+
+@lru_cache(maxsize=256)
+def _fmt_key(key: str) -> str:
+    """格式化JSON键名，同一输出结构的键名只格式化一次"""
+    return key.replace('_', ' ').title()
+
 
 class DeepSeekProcessor:
     """DeepSeek-R1 输出处理器"""
     
+    # 预编译的正则表达式，每次回答处理时直接使用
+    _RE_THINK = re.compile(r'<think>.*?</think>', re.DOTALL)
+    _RE_MODEL_MARK = re.compile(r'<\|.*?\|>')
+    _RE_JSON_OPEN = re.compile(r'```json\s*')
+    _RE_JSON_CLOSE = re.compile(r'```\s*$')
+    _RE_BLANKLINES = re.compile(r'\n\s*\n\s*\n')
+    _RE_SPACES = re.compile(r'[ \t]+')
+    # 错误信息模式合并为一个表达式，一次扫描完成匹配
+    _RE_ERRORS = re.compile(
+        '|'.join([
+            r'BadRequestError',
+            r'无法处理',
+            r'处理时出现问题',
+            r'编码问题'
+        ]),
+        re.IGNORECASE
+    )
+    
     @staticmethod
     def clean_content(content: str) -> str:
         """清理DeepSeek输出内容"""
@@ -24,14 +56,14 @@ class DeepSeekProcessor:
             content = DeepSeekProcessor._fix_unicode_issues(content)
             
             # 步骤2: 移除控制字符，但保留常用的换行符
-            content = ''.join(char for char in content if ord(char) >= 32 or char in '\n\r\t')
+            content = content.translate(_CTRL_DROP)
             
             # 步骤3: 处理DeepSeek特有的标记
             content = DeepSeekProcessor._remove_deepseek_markers(content)
             
             # 步骤4: 清理多余的空白
-            content = re.sub(r'\n\s*\n\s*\n', '\n\n', content)  # 多个空行变成两个
-            content = re.sub(r'[ \t]+', ' ', content)  # 多个空格变成一个
+            content = DeepSeekProcessor._RE_BLANKLINES.sub('\n\n', content)  # 多个空行变成两个
+            content = DeepSeekProcessor._RE_SPACES.sub(' ', content)  # 多个空格变成一个
             content = content.strip()
             
             # 步骤5: 最终验证
@@ -50,25 +82,9 @@ class DeepSeekProcessor:
             return ""
         
         try:
-            # 方法1: 使用errors='ignore'移除无效字符
-            cleaned = content.encode('utf-8', errors='ignore').decode('utf-8', errors='ignore')
-            
-            # 方法2: 如果还有问题，逐字符检查
-            if len(cleaned) < len(content) * 0.8:  # 如果丢失太多内容，尝试逐字符修复
-                result = []
-                for char in content:
-                    try:
-                        # 检查字符是否可以正常编码
-                        char.encode('utf-8')
-                        # 检查是否是代理对
-                        if 0xD800 <= ord(char) <= 0xDFFF:
-                            continue  # 跳过代理对字符
-                        result.append(char)
-                    except (UnicodeEncodeError, UnicodeDecodeError):
-                        continue  # 跳过有问题的字符
-                
-                cleaned = ''.join(result)
-            
+            # 先移除代理对字符，再通过编码往返移除其余无效字符
+            cleaned = content.translate(_SURROGATE_DROP)
+            cleaned = cleaned.encode('utf-8', errors='ignore').decode('utf-8', errors='ignore')
             return cleaned
             
         except Exception as e:
@@ -101,14 +117,14 @@ class DeepSeekProcessor:
     def _remove_deepseek_markers(content: str) -> str:
         """移除DeepSeek特有的标记"""
         # 移除思考标记
-        content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL)
+        content = DeepSeekProcessor._RE_THINK.sub('', content)
         
         # 移除模型内部标记
-        content = re.sub(r'<\|.*?\|>', '', content)
+        content = DeepSeekProcessor._RE_MODEL_MARK.sub('', content)
         
         # 移除JSON代码块标记
-        content = re.sub(r'```json\s*', '', content)
-        content = re.sub(r'```\s*$', '', content)
+        content = DeepSeekProcessor._RE_JSON_OPEN.sub('', content)
+        content = DeepSeekProcessor._RE_JSON_CLOSE.sub('', content)
         
         return content
     
@@ -128,36 +144,7 @@ class DeepSeekProcessor:
             # 如果没有找到常见字段，尝试解析复杂的JSON结构
             if not answer:
                 # 尝试提取所有文本内容并格式化
-                def extract_text_from_dict(obj, depth=0):
-                    if depth > 3:  # 防止无限递归
-                        return ""
-                    
-                    texts = []
-                    if isinstance(obj, dict):
-                        for key, value in obj.items():
-                            if isinstance(value, str) and len(value) > 10:
-                                # 格式化键名
-                                formatted_key = key.replace('_', ' ').title()
-                                texts.append(f"**{formatted_key}**: {value}")
-                            elif isinstance(value, (dict, list)):
-                                sub_text = extract_text_from_dict(value, depth + 1)
-                                if sub_text:
-                                    formatted_key = key.replace('_', ' ').title()
-                                    if depth == 0:
-                                        texts.append(f"\n## {formatted_key}\n{sub_text}")
-                                    else:
-                                        texts.append(f"**{formatted_key}**: {sub_text}")
-                    elif isinstance(obj, list):
-                        for i, item in enumerate(obj):
-                            sub_text = extract_text_from_dict(item, depth + 1)
-                            if sub_text:
-                                texts.append(f"{i+1}. {sub_text}")
-                    elif isinstance(obj, str) and len(obj) > 10:
-                        texts.append(obj)
-                    
-                    return "\n".join(texts) if depth == 0 else " ".join(texts)
-                
-                answer = extract_text_from_dict(json_response)
+                answer = DeepSeekProcessor._extract_text_from_json(json_response)
         
         # 如果JSON响应为空或无效，使用think_response
         if not answer and think_response:
@@ -172,6 +159,48 @@ class DeepSeekProcessor:
         
         return answer
     
+    @staticmethod
+    def _iter_json_children(obj, depth: int):
+        """遍历JSON节点的子项，产出 (文本, None) 或 (子节点, 子节点文本的前缀)"""
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                if isinstance(value, str) and len(value) > 10:
+                    yield f"**{_fmt_key(key)}**: {value}", None
+                elif isinstance(value, (dict, list)):
+                    if depth == 0:
+                        yield value, f"\n## {_fmt_key(key)}\n"
+                    else:
+                        yield value, f"**{_fmt_key(key)}**: "
+        elif isinstance(obj, list):
+            for i, item in enumerate(obj):
+                yield item, f"{i+1}. "
+        elif isinstance(obj, str) and len(obj) > 10:
+            yield obj, None
+    
+    @staticmethod
+    def _extract_text_from_json(obj) -> str:
+        """提取JSON中的文本内容并格式化，使用显式栈迭代遍历，最多深入 _MAX_EXTRACT_DEPTH 层"""
+        # 栈帧：(子项迭代器, 深度, 已提取的文本, 本节点文本的前缀)
+        stack = deque([(DeepSeekProcessor._iter_json_children(obj, 0), 0, [], None)])
+        while stack:
+            children, depth, texts, prefix = stack[-1]
+            for child, child_prefix in children:
+                if child_prefix is None:
+                    texts.append(child)
+                elif depth < _MAX_EXTRACT_DEPTH:
+                    stack.append(
+                        (DeepSeekProcessor._iter_json_children(child, depth + 1), depth + 1, [], child_prefix)
+                    )
+                    break
+            else:
+                stack.pop()
+                text = "\n".join(texts) if depth == 0 else " ".join(texts)
+                if not stack:
+                    return text
+                if text:
+                    stack[-1][2].append(prefix + text)
+        return ""
+    
     @staticmethod
     def validate_answer(answer: str) -> bool:
         """验证答案是否有效"""
@@ -179,18 +208,7 @@ class DeepSeekProcessor:
             return False
         
         # 检查是否只包含错误信息
-        error_patterns = [
-            r'BadRequestError',
-            r'无法处理',
-            r'处理时出现问题',
-            r'编码问题'
-        ]
-        
-        for pattern in error_patterns:
-            if re.search(pattern, answer, re.IGNORECASE):
-                return False
-        
-        return True
+        return DeepSeekProcessor._RE_ERRORS.search(answer) is None
     
     @staticmethod
     def format_financial_answer(answer: str, context_used: bool = False) -> str:
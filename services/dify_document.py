@@ -1,25 +1,71 @@
-import json
+import gzip
+from functools import lru_cache
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from logger import task_logger
 from models.database import PostsDB
 
+# 开启请求体压缩时，超过该大小（字节）的请求体使用gzip压缩
+GZIP_MIN_SIZE = 32 * 1024
+
 
 class DifyDatasetAPI:
-    def __init__(self, api_key, base_url="http://localhost"):
+    def __init__(self, api_key, base_url="http://localhost", gzip_requests=False):
         """
         初始化DatasetAPI类
 
         参数:
             api_key (str): API密钥
             base_url (str): API基础URL，默认为http://localhost
+            gzip_requests (bool): 是否压缩较大的POST请求体，需服务端（或其前置代理）支持
+                Content-Encoding: gzip，默认关闭
         """
         self.api_key = api_key
         self.base_url = base_url
+        self.gzip_requests = gzip_requests
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
+        # 复用连接的会话，连续请求同一主机时无需重复建立TCP/TLS连接
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=20,
+            pool_maxsize=50,
+            max_retries=Retry(
+                total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Authorization": f"Bearer {self.api_key}"})
+        # 数据集元数据结构在进程内不会变化，同一数据集只请求一次
+        self._get_dataset_metadata_cached = lru_cache(maxsize=None)(
+            self._fetch_dataset_metadata
+        )
+
+    def _post_json(self, url, payload):
+        """以orjson直接编码为UTF-8字节发送POST请求，开启压缩时较大的请求体使用gzip压缩"""
+        body = orjson.dumps(payload)
+        headers = self.headers
+        if self.gzip_requests and len(body) > GZIP_MIN_SIZE:
+            body = gzip.compress(body, compresslevel=5)
+            headers = {**self.headers, "Content-Encoding": "gzip"}
+        return self.session.post(url, headers=headers, data=body)
+
+    def close(self):
+        """关闭会话，释放连接池"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def create_document_by_text(
         self,
@@ -124,11 +170,9 @@ class DifyDatasetAPI:
             payload["embedding_model_provider"] = embedding_model_provider
 
         # 打印请求体便于调试
-        # print("请求体: ", json.dumps(payload, ensure_ascii=False, indent=2))
+        # print("请求体: ", orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode())
 
-        response = requests.post(
-            url, headers=self.headers, data=json.dumps(payload, ensure_ascii=False)
-        )
+        response = self._post_json(url, payload)
         return response.json()
 
     def update_document_metadata(self, dataset_id, operation_data):
@@ -146,9 +190,7 @@ class DifyDatasetAPI:
 
         payload = {"operation_data": operation_data}
 
-        response = requests.post(
-            url, headers=self.headers, data=json.dumps(payload, ensure_ascii=False)
-        )
+        response = self._post_json(url, payload)
         return response.json()
 
     def get_documents(self, dataset_id, page=1, limit=20, search=None):
@@ -172,15 +214,12 @@ class DifyDatasetAPI:
         if search:
             params["keyword"] = search
 
-        # 对于GET请求，使用不包含Content-Type的头
-        headers = {"Authorization": f"Bearer {self.api_key}"}
-
-        response = requests.get(url, headers=headers, params=params)
+        response = self.session.get(url, params=params)
         return response.json()
 
     def get_dataset_metadata(self, dataset_id):
         """
-        获取数据集元数据
+        获取数据集元数据，同一数据集的结果在实例内缓存
 
         参数:
             dataset_id (str): 数据集ID
@@ -188,20 +227,20 @@ class DifyDatasetAPI:
         返回:
             dict: API响应，包含数据集的元数据信息
         """
-        url = f"{self.base_url}/v1/datasets/{dataset_id}/metadata"
+        return self._get_dataset_metadata_cached(dataset_id)
 
-        # 对于GET请求，不需要Content-Type头
-        headers = {"Authorization": f"Bearer {self.api_key}"}
+    def _fetch_dataset_metadata(self, dataset_id):
+        """请求数据集元数据"""
+        url = f"{self.base_url}/v1/datasets/{dataset_id}/metadata"
 
-        response = requests.get(url, headers=headers)
+        response = self.session.get(url)
         return response.json()
 
     def get_segment(self, dataset_id, document_id):
         url = (
             f"{self.base_url}/v1/datasets/{dataset_id}/documents/{document_id}/segments"
         )
-        headers = {"Authorization": f"Bearer {self.api_key}"}
-        response = requests.get(url, headers=headers)
+        response = self.session.get(url)
         return response.json()
 
     def delete_document(self, dataset_id, document_id):
@@ -217,13 +256,17 @@ class DifyDatasetAPI:
         """
         url = f"{self.base_url}/v1/datasets/{dataset_id}/documents/{document_id}"
 
-        # 对于DELETE请求，只需要Authorization头
-        headers = {"Authorization": f"Bearer {self.api_key}"}
-
-        response = requests.delete(url, headers=headers)
-
-        # 根据API文档，成功删除返回204 No Content
-        return response.json() == 204
+        response = self.session.delete(url)
+        try:
+            response.raise_for_status()
+            # 根据API文档，成功删除返回204 No Content，响应体为空
+            return response.status_code == 204
+        except requests.HTTPError as e:
+            # 删除失败记录日志后返回False，保持返回值约定
+            task_logger.error(f"删除知识库文档失败 | ID: {document_id} | {e}")
+            return False
+        finally:
+            response.close()
 
 
 if __name__ == "__main__":
@@ -235,6 +278,8 @@ if __name__ == "__main__":
         "LogicalReview": "逻辑复盘",
         "Essence": "精华",
     }
+    # 同时处理的帖子数
+    CONCURRENCY = 20
     posts_db = PostsDB()
 
     # 创建API实例
@@ -243,65 +288,145 @@ if __name__ == "__main__":
     )
     dataset_id = "abb12faf-b9b1-4b2f-9671-6a0202f727de"
 
-    # 获取元数据
-    metadata = api.get_dataset_metadata(dataset_id=dataset_id)
-
-    # 获取帖子并处理
-    for type, name in TYPE_MAP.items():
-        posts = asyncio.run(posts_db.get_posts(type=type, limit=None))
-        for post in tqdm(posts, desc=f"处理{name}帖子"):
-            post["type"] = name
-            documents = api.get_documents(dataset_id=dataset_id, search=post["md5"])
-            if documents.get("data", []):
-                continue
-            # 创建文档
-            document_result = api.create_document_by_text(
-                dataset_id=dataset_id,
-                name=post["md5"],
-                text=post["mes"],
-                doc_form="hierarchical_model",  # 使用父子分段模式
-                process_mode="hierarchical",
-                parent_mode="full-doc",
-                subchunk_segmentation={
-                    "separator": "\\n",  # 段落分隔符
-                    "max_tokens": 512,  # 最大512字符
-                    "chunk_overlap": 50,  # 分段重叠50个字符
-                },
-                pre_processing_rules=[
-                    {"id": "remove_extra_spaces", "enabled": True},
-                    {"id": "remove_urls_emails", "enabled": True},
-                ],
-            )
+    def process_post(post, meta_fields, existing):
+        """处理单个帖子：文档不存在时创建文档并更新元数据"""
+        if post["md5"] in existing:
+            return
+        # 创建文档
+        document_result = api.create_document_by_text(
+            dataset_id=dataset_id,
+            name=post["md5"],
+            text=post["mes"],
+            doc_form="hierarchical_model",  # 使用父子分段模式
+            process_mode="hierarchical",
+            parent_mode="full-doc",
+            subchunk_segmentation={
+                "separator": "\\n",  # 段落分隔符
+                "max_tokens": 512,  # 最大512字符
+                "chunk_overlap": 50,  # 分段重叠50个字符
+            },
+            pre_processing_rules=[
+                {"id": "remove_extra_spaces", "enabled": True},
+                {"id": "remove_urls_emails", "enabled": True},
+            ],
+        )
 
-            # 准备元数据
-            metadata_list = [
-                {"id": item["id"], "value": post[item["name"]], "name": item["name"]}
-                for item in metadata["doc_metadata"]
-            ]
+        # 准备元数据，新建文档没有元数据，空值字段无需写入
+        metadata_list = [
+            {"id": field_id, "value": post[field_name], "name": field_name}
+            for field_id, field_name in meta_fields
+            if post.get(field_name) is not None
+        ]
 
-            # 更新文档元数据
+        # 更新文档元数据，没有需要写入的字段时省去一次请求
+        if metadata_list:
             operation_data = [
                 {
                     "document_id": document_result["document"]["id"],
                     "metadata_list": metadata_list,
                 }
             ]
-            metadata_result = api.update_document_metadata(
+            api.update_document_metadata(
                 dataset_id=dataset_id, operation_data=operation_data
             )
-            print(post["md5"])
-
-    # 删除不在库里面的知识库文档
-    for page in range(1, 100):
-        documents = api.get_documents(dataset_id=dataset_id, page=page, limit=100)
-        if documents.get("data", []):
-            for document in documents.get("data", []):
-                if asyncio.run(posts_db.get_posts_by_ids([document["name"]])):
-                    continue
-                else:
-                    delete_status = api.delete_document(
-                        dataset_id=dataset_id, document_id=document["id"]
+        existing.add(post["md5"])
+        print(post["md5"])
+
+    async def list_documents():
+        """分页获取知识库中的全部文档，根据第一页返回的总数并发获取其余页"""
+        page_size = 100
+        first = await asyncio.to_thread(
+            api.get_documents, dataset_id=dataset_id, page=1, limit=page_size
+        )
+        documents = list(first.get("data", []))
+        num_pages = -(-first.get("total", 0) // page_size)
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+
+        async def fetch_page(page):
+            async with semaphore:
+                result = await asyncio.to_thread(
+                    api.get_documents, dataset_id=dataset_id, page=page, limit=page_size
+                )
+            return result.get("data", [])
+
+        pages = await asyncio.gather(
+            *(fetch_page(page) for page in range(2, num_pages + 1))
+        )
+        for page in pages:
+            documents.extend(page)
+        return documents
+
+    async def main():
+        # 获取元数据
+        metadata = await asyncio.to_thread(
+            api.get_dataset_metadata, dataset_id=dataset_id
+        )
+        # 元数据字段只需解析一次，所有帖子共用
+        meta_fields = [(item["id"], item["name"]) for item in metadata["doc_metadata"]]
+        # 一次性获取知识库中已有的文档，按名称（帖子md5）判断是否已存在，避免逐个帖子查询
+        remote_documents = await list_documents()
+        existing = {document["name"] for document in remote_documents}
+
+        # 每个帖子的请求链在线程中执行，多个帖子并发处理，限制同时处理的数量
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+
+        async def process(post, progress):
+            """处理单个帖子，调用方已获取信号量，处理完成后释放"""
+            try:
+                await asyncio.to_thread(process_post, post, meta_fields, existing)
+            except Exception as e:
+                print(post["md5"], f"处理失败: {e}")
+            finally:
+                semaphore.release()
+                progress.update(1)
+
+        async def ingest(type, name, progress):
+            """流式读取指定类型的帖子，边读取边处理，内存中只保留正在处理的帖子"""
+            tasks = set()
+            cursor = await posts_db.get_posts(type=type, limit=None, stream=True)
+            async for post in cursor:
+                post["type"] = name
+                # 并发槽位占满时暂停读取游标
+                await semaphore.acquire()
+                task = asyncio.create_task(process(post, progress))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+
+        # 各类型的帖子并发读取和处理，类型之间不再串行等待，并发槽位始终保持占满
+        # 流式读取无法预知帖子总数，单独统计后设置进度条总数
+        counts = await asyncio.gather(*(posts_db.count_posts(type) for type in TYPE_MAP))
+        with tqdm(total=sum(counts), desc="处理帖子") as progress:
+            await asyncio.gather(
+                *(ingest(type, name, progress) for type, name in TYPE_MAP.items())
+            )
+
+        # 删除不在库里面的知识库文档（本次新建的文档都对应库中的帖子，无需重新获取列表）
+        # 一次批量查询库中存在的帖子md5，只返回md5字段，由索引直接返回结果
+        stored_posts = await posts_db.get_posts_by_ids(
+            [document["name"] for document in remote_documents],
+            projection={"_id": 0, "md5": 1},
+        )
+        stored_names = {post["md5"] for post in stored_posts}
+        stale_documents = [
+            document
+            for document in remote_documents
+            if document["name"] not in stored_names
+        ]
+
+        async def delete(document):
+            async with semaphore:
+                try:
+                    delete_status = await asyncio.to_thread(
+                        api.delete_document,
+                        dataset_id=dataset_id,
+                        document_id=document["id"],
                     )
-                    print(document["name"], delete_status)
-        else:
-            break
+                except Exception as e:
+                    delete_status = f"删除失败: {e}"
+            print(document["name"], delete_status)
+
+        await asyncio.gather(*(delete(document) for document in stale_documents))
+
+    with api:
+        asyncio.run(main())
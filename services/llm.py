@@ -1,7 +1,12 @@
-import json
-from typing import List, Tuple
+import asyncio
+import re
+import threading
+from functools import lru_cache
+from typing import AsyncGenerator, Dict, List, Set, Tuple
 
+import httpx
 import openai
+import orjson
 from openai import BadRequestError
 
 from config.settings import LLM_SETTINGS
@@ -11,6 +16,129 @@ ModelName = LLM_SETTINGS["model"]
 ApiKey = LLM_SETTINGS["api_key"]
 BaseUrl = LLM_SETTINGS["base_url"]
 
+# HTTP连接池配置：空闲连接保留较长时间，相邻的调用复用已建立的TLS连接
+LLM_HTTP_LIMITS = httpx.Limits(
+    max_connections=64, max_keepalive_connections=32, keepalive_expiry=60
+)
+
+
+@lru_cache(maxsize=None)
+def _get_client(api_key: str, base_url: str) -> openai.OpenAI:
+    """获取进程内共享的同步客户端，相同服务地址和密钥的LLMService共用同一个连接池"""
+    return openai.OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=openai.DefaultHttpxClient(limits=LLM_HTTP_LIMITS),
+    )
+
+
+# 默认配置的共享客户端，导入时创建
+_CLIENT = _get_client(ApiKey, BaseUrl)
+
+# 各 (服务地址, 模型) 明确不支持的可选请求参数，被接口拒绝后记录，之后不再发送
+_UNSUPPORTED_PARAMS: Dict[Tuple[str, str], Set[str]] = {}
+# 接口以"参数不支持"拒绝请求时错误信息中常见的描述
+_UNSUPPORTED_MARKERS = (
+    "unsupported",
+    "not supported",
+    "unrecognized",
+    "unknown",
+    "not permitted",
+    "unavailable",
+    "extra",
+)
+
+
+def _is_unsupported_param_error(error: BadRequestError, param: str) -> bool:
+    """判断请求是否因为不支持指定参数而被拒绝（而不是参数用法不对）"""
+    message = str(error).lower()
+    return param in message and any(marker in message for marker in _UNSUPPORTED_MARKERS)
+
+# 整段输出就是一个代码块时，锚定匹配即可取出内容，无需在全文中搜索
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+# Markdown代码块中的JSON内容
+_JSON_BLOCK_RE = re.compile(r"```(?:json)?\s*(\{.*\}|\[.*\])\s*```", re.DOTALL)
+_NOT_FOUND = object()
+
+
+def _loads_or_missing(text: str):
+    """解析JSON，失败时返回 _NOT_FOUND"""
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return _NOT_FOUND
+
+
+class _JsonScanner:
+    """增量扫描文本，跟踪从第一个 { 或 [ 开始的括号深度，找到与之匹配的结束位置"""
+
+    def __init__(self):
+        self.start = -1  # 第一个括号在已扫描文本中的位置
+        self.offset = 0  # 已扫描的字符数
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text: str) -> int:
+        """继续扫描一段文本，JSON结束时返回结束字符在该段文本中的位置，否则返回-1"""
+        for i, char in enumerate(text):
+            if self.start == -1:
+                if char not in "{[":
+                    continue
+                self.start = self.offset + i
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.offset += i + 1
+                    return i
+        self.offset += len(text)
+        return -1
+
+
+def _balanced_json(text: str):
+    """从第一个 { 或 [ 开始按括号深度找到与之匹配的结束位置，返回该JSON片段"""
+    scanner = _JsonScanner()
+    end = scanner.feed(text)
+    if end == -1:
+        return None
+    return text[scanner.start : end + 1]
+
+
+def _extract_json(text: str):
+    """从LLM输出中提取JSON：依次尝试直接解析、Markdown代码块、括号匹配，均失败时返回 _NOT_FOUND"""
+    text = text.strip()
+    result = _loads_or_missing(text)
+    if result is not _NOT_FOUND:
+        return result
+
+    match = _FENCE_RE.match(text)
+    if match:
+        result = _loads_or_missing(match.group(1))
+        if result is not _NOT_FOUND:
+            return result
+
+    match = _JSON_BLOCK_RE.search(text)
+    if match:
+        result = _loads_or_missing(match.group(1))
+        if result is not _NOT_FOUND:
+            return result
+
+    fragment = _balanced_json(text)
+    if fragment is not None:
+        return _loads_or_missing(fragment)
+    return _NOT_FOUND
+
 
 class LLMService:
     def __init__(
@@ -19,67 +147,208 @@ class LLMService:
         api_key=ApiKey,
         base_url=BaseUrl,
     ):
-        self.client = openai.OpenAI(api_key=api_key, base_url=base_url)
+        self.client = _get_client(api_key, base_url)
+        self.api_key = api_key
         self.model = model_name
+        self.base_url = str(base_url)
+        # 异步客户端的连接池绑定创建它的事件循环，每个事件循环使用各自的客户端
+        self._async_clients = {}
+        self._async_lock = threading.Lock()
 
-    def call_llm(
-        self, messages: List[dict], max_retries: int = 3, timeout: tuple = None
+    def _get_async_client(self) -> openai.AsyncOpenAI:
+        """获取当前事件循环对应的异步客户端，已关闭的事件循环遗留的客户端随之丢弃"""
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            for closed_loop in [l for l in self._async_clients if l.is_closed()]:
+                del self._async_clients[closed_loop]
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = self._async_clients[loop] = openai.AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    http_client=openai.DefaultAsyncHttpxClient(limits=LLM_HTTP_LIMITS),
+                )
+        return client
+
+    @property
+    def supports_json_mode(self) -> bool:
+        """当前服务地址和模型是否支持 response_format 的JSON模式，按 (服务地址, 模型) 记录"""
+        return "response_format" not in _UNSUPPORTED_PARAMS.get(
+            (self.base_url, self.model), set()
+        )
+
+    async def astream_llm(
+        self, messages: List[dict], timeout: tuple = None
+    ) -> AsyncGenerator[str, None]:
+        """流式调用OpenAI接口，逐段返回生成的文本"""
+        try:
+            response = await self._get_async_client().chat.completions.create(
+                model=self.model,
+                messages=messages,
+                timeout=timeout,
+                stream=True,
+            )
+        except BadRequestError as e:
+            task_logger.error("流式调用LLM接口失败: %s", e)
+            return
+
+        async for chunk in response:
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                yield content
+
+    def _stream_completion(
+        self, messages: List[dict], timeout: tuple = None, json_mode: bool = False
     ) -> Tuple:
-        """统一调用OpenAI接口"""
+        """流式调用接口并拼接输出，返回 (输出内容, 思考过程等附加字段)
+
+        普通模式下输出以JSON开头时，JSON完整后立即关闭响应，不等待模型生成其后的多余内容
+        （此时拿不到末尾的用量统计）；JSON模式的输出只有JSON本身，直接读完响应，
+        无需逐字符扫描，用量统计照常记录
+        """
+        unsupported = _UNSUPPORTED_PARAMS.get((self.base_url, self.model), set())
+        kwargs = {}
+        if "stream_options" not in unsupported:
+            kwargs["stream_options"] = {"include_usage": True}
+        if json_mode:
+            kwargs["response_format"] = {"type": "json_object"}
         try:
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 timeout=timeout,
-                # response_format={"type": "json_object"},
+                stream=True,
+                **kwargs,
+            )
+        except BadRequestError as e:
+            if "stream_options" not in kwargs or not _is_unsupported_param_error(
+                e, "stream_options"
+            ):
+                raise
+            _UNSUPPORTED_PARAMS.setdefault((self.base_url, self.model), set()).add(
+                "stream_options"
             )
-            token_logger.info(
-                f"调用LLM接口，token使用情况：{response.usage.total_tokens}"
+            task_logger.info(
+                "模型 %s 不支持 stream_options，不再统计流式调用的token用量", self.model
             )
+            return self._stream_completion(messages, timeout, json_mode)
+
+        parts = []
+        extra = {}
+        # JSON模式不扫描；None 表示尚未判断输出是否以JSON开头
+        scanner = False if json_mode else None
+        stopped_early = False
+        total_tokens = None
+        try:
+            for chunk in response:
+                if chunk.usage:
+                    total_tokens = chunk.usage.total_tokens
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                # 思考过程等非标准字段（如reasoning_content）按字段拼接
+                for key, value in (delta.model_extra or {}).items():
+                    if isinstance(value, str):
+                        extra[key] = extra.get(key, "") + value
+                if not delta.content:
+                    continue
+                parts.append(delta.content)
+                if scanner is None:
+                    head = "".join(parts).lstrip()
+                    if not head:
+                        continue
+                    # 只有输出以JSON或代码块开头时才提前结束，避免截断夹杂括号的普通文本
+                    if head[0] not in "{[`":
+                        scanner = False
+                        continue
+                    scanner = _JsonScanner()
+                    stopped_early = scanner.feed("".join(parts)) != -1
+                elif scanner:
+                    stopped_early = scanner.feed(delta.content) != -1
+                if stopped_early:
+                    break
+        finally:
+            response.close()
+
+        if total_tokens is not None:
+            token_usage = total_tokens
+        elif stopped_early:
+            token_usage = "未知（已提前结束读取）"
+        else:
+            token_usage = "未知"
+        token_logger.info("调用LLM接口，token使用情况：%s", token_usage)
+        return "".join(parts), extra
+
+    def _json_completion(
+        self, messages: List[dict], timeout: tuple = None, json_mode: bool = False
+    ) -> Tuple:
+        """调用接口，模型支持时使用JSON模式，JSON模式的请求被拒绝（400）时本次改用普通模式
+
+        只有接口明确表示不支持 response_format 时才对该服务地址和模型停用JSON模式，
+        其他错误（如提示词中缺少"json"、服务商的错误信息格式不同）只影响本次调用
+        """
+        if json_mode and self.supports_json_mode:
+            try:
+                return self._stream_completion(messages, timeout, json_mode=True)
+            except BadRequestError as e:
+                if _is_unsupported_param_error(e, "response_format"):
+                    _UNSUPPORTED_PARAMS.setdefault((self.base_url, self.model), set()).add(
+                        "response_format"
+                    )
+                    task_logger.info("模型 %s 不支持JSON模式，改用普通模式", self.model)
+                else:
+                    task_logger.info("JSON模式请求被拒绝，本次改用普通模式: %s", e)
+        return self._stream_completion(messages, timeout)
+
+    def call_llm(
+        self,
+        messages: List[dict],
+        max_retries: int = 3,
+        timeout: tuple = None,
+        json_mode: bool = False,
+    ) -> Tuple:
+        """统一调用OpenAI接口，json_mode为True时要求模型直接输出JSON对象（提示词需要求JSON输出）"""
+        try:
+            content, think_response = self._json_completion(messages, timeout, json_mode)
         except BadRequestError as e:
             # 处理BadRequestError异常
             return "BadRequestError", False
 
-        think_response = response.choices[0].message.model_extra
+        # 先在本地尽量提取JSON，只有提取失败时才让LLM重新生成
+        json_response = _extract_json(content)
         retries = 0
-        while retries < max_retries:
-            json_str = (
-                response.choices[0]
-                .message.content.strip()
-                .strip("```")
-                .lstrip("json")
-                .strip()
-            )
+        while json_response is _NOT_FOUND and retries < max_retries:
+            messages += [
+                {
+                    "role": "assistant",
+                    "content": content,
+                },
+                {
+                    "role": "user",
+                    "content": "请严格遵循JSON格式输出，直接返回有效的JSON对象，不要包含任何额外文本或Markdown代码块",
+                },
+            ]
             try:
-                json_response = json.loads(json_str)
-                break
-            except json.decoder.JSONDecodeError:
-                messages += [
-                    {
-                        "role": "assistant",
-                        "content": json_str,
-                    },
-                    {
-                        "role": "user",
-                        "content": "请严格遵循JSON格式输出，直接返回有效的JSON对象，不要包含任何额外文本或Markdown代码块",
-                    },
-                ]
-                try:
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        messages=messages,
-                        timeout=timeout,
-                    )
-                    token_logger.info(
-                        f"调用LLM接口，token使用情况：{response.usage.total_tokens}"
-                    )
-                except BadRequestError as e:
-                    # 处理BadRequestError异常
-                    return "BadRequestError", False
-                retries += 1
-        else:
+                content, _ = self._json_completion(messages, timeout, json_mode)
+            except BadRequestError as e:
+                # 处理BadRequestError异常
+                return "BadRequestError", False
+            retries += 1
+            json_response = _extract_json(content)
+
+        if retries:
+            token_logger.info("JSON解析失败，重新调用LLM次数：%s", retries)
+        if json_response is _NOT_FOUND:
             task_logger.error(
-                f"无法解析JSON响应，请检查LLM的输出格式是否正确: {json_str}"
+                f"无法解析JSON响应，请检查LLM的输出格式是否正确: {content}"
             )
             json_response = {}
         return think_response, json_response
+
+
+@lru_cache(maxsize=1)
+def get_llm_service() -> LLMService:
+    """获取共享的LLM服务实例，复用底层HTTP连接池"""
+    return LLMService()
@@ -1,3 +1,9 @@
+import asyncio
+import atexit
+import threading
+from itertools import islice
+
+from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import MongoClient
 from pymongo.errors import (
     ConnectionFailure,
@@ -9,6 +15,16 @@ from pymongo.errors import (
 from config.settings import MONGODB_SETTINGS
 from logger import task_logger
 
+# 批量按ID查询时每次 $in 查询包含的ID数量
+BATCH_FETCH_CHUNK_SIZE = 1000
+
+
+def _chunked(items: list, size: int):
+    """按固定大小切分列表"""
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
 
 class MongoDBService:
     _instance = None
@@ -22,7 +38,13 @@ class MongoDBService:
     def __init__(self):
         if not self._is_initialized:
             try:
-                self.client = MongoClient(MONGODB_SETTINGS["uri"])
+                self.client = MongoClient(
+                    MONGODB_SETTINGS["uri"],
+                    maxPoolSize=MONGODB_SETTINGS["pool_size"],
+                    minPoolSize=5,
+                    waitQueueTimeoutMS=5000,
+                    serverSelectionTimeoutMS=3000,
+                )
                 self.client.admin.command("ping")
                 self.db = self.client[MONGODB_SETTINGS["database"]]
                 task_logger.info("✅ MongoDB连接成功")
@@ -51,6 +73,24 @@ class MongoDBService:
             # 以及其他可能的错误类型
             pass
 
+    def create_index(
+        self, collection_name: str, keys: list, name: str = None, **kwargs
+    ) -> bool:
+        """
+        创建索引（索引已存在时不会重复创建）
+        :param collection_name: 集合名称
+        :param keys: 索引字段列表，如 [("type", 1), ("date", -1)]
+        :param name: 索引名称
+        :param kwargs: 其他索引选项，如 expireAfterSeconds
+        :return: 创建结果（True/False）
+        """
+        try:
+            self.db[collection_name].create_index(keys, name=name, **kwargs)
+            return True
+        except PyMongoError as e:
+            task_logger.error(f"❌ 创建索引失败: {collection_name} {name} {e}")
+            return False
+
     def fetch_data(
         self,
         collection_name: str,
@@ -60,6 +100,7 @@ class MongoDBService:
         sort_order: int = -1,
         skip: int = None,
         limit: int = None,
+        stream: bool = False,
     ):
         """
         查询指定集合中的数据
@@ -68,7 +109,8 @@ class MongoDBService:
         :param sort_field: 排序字段
         :param sort_order: 排序方式（-1降序/1升序）
         :param limit: 返回结果数量限制
-        :return: 文档列表
+        :param stream: 为True时直接返回游标，遍历时按批次从服务器拉取，不一次性加载全部结果
+        :return: 文档列表（stream为True时返回游标）
         """
         try:
             collection = self.db[collection_name]
@@ -91,30 +133,89 @@ class MongoDBService:
             if limit:
                 cursor = cursor.limit(limit)
 
+            if stream:
+                return cursor
             return list(cursor)
         except PyMongoError as e:
             task_logger.error(f"❌ 数据库查询错误: {e}")
             return []
 
+    def iter_data(
+        self,
+        collection_name: str,
+        query: dict = None,
+        projection: dict = None,
+        sort_field: str = None,
+        sort_order: int = -1,
+        batch_size: int = 500,
+    ):
+        """
+        以游标形式查询指定集合中的数据，按批次从服务器拉取，不一次性加载全部结果
+        :param collection_name: 集合名称
+        :param query: 查询条件
+        :param projection: 返回字段投影
+        :param sort_field: 排序字段
+        :param sort_order: 排序方式（-1降序/1升序）
+        :param batch_size: 每次从服务器拉取的文档数量
+        :return: 文档游标
+        """
+        cursor = self.db[collection_name].find(
+            filter=query or {}, projection=projection or {"_id": 0}
+        )
+        if sort_field:
+            cursor = cursor.sort(sort_field, sort_order)
+        return cursor.batch_size(batch_size)
+
+    def aggregate(self, collection_name: str, pipeline: list) -> list:
+        """
+        执行聚合查询
+        :param collection_name: 集合名称
+        :param pipeline: 聚合管道
+        :return: 聚合结果列表
+        """
+        try:
+            return list(self.db[collection_name].aggregate(pipeline))
+        except PyMongoError as e:
+            task_logger.error(f"❌ 聚合查询错误: {e}")
+            return []
+
+    def count_documents(self, collection_name: str, query: dict = None) -> int:
+        """
+        统计指定集合中符合条件的文档数量
+        :param collection_name: 集合名称
+        :param query: 查询条件
+        :return: 文档数量
+        """
+        try:
+            return self.db[collection_name].count_documents(query or {})
+        except PyMongoError as e:
+            task_logger.error(f"❌ 统计文档数量错误: {e}")
+            return 0
+
     def batch_fetch_by_ids(
         self,
         collection_name: str,
         id_list: list[str],
         ids_field: str = "id",
         projection: dict = None,
+        chunk_size: int = BATCH_FETCH_CHUNK_SIZE,
     ):
         """
-        批量查询指定集合中的数据
+        批量查询指定集合中的数据，ID较多时按 chunk_size 分批查询
+        ids_field 需建有索引，投影只包含索引字段且排除 _id 时可直接由索引返回结果
         :param collection_name: 集合名称
         :param id_list: 需要查询的ID列表
         :param ids_field: ID字段名称
         :param projection: 返回字段投影
+        :param chunk_size: 每次查询的ID数量
         :return: 文档列表
         """
         try:
-            query = {ids_field: {"$in": id_list}}
             projection = projection or {"_id": 0}
-            result = self.fetch_data(collection_name, query, projection)
+            result = []
+            for chunk in _chunked(id_list, chunk_size):
+                query = {ids_field: {"$in": chunk}}
+                result.extend(self.fetch_data(collection_name, query, projection))
 
             return result
         except PyMongoError as e:
@@ -141,6 +242,20 @@ class MongoDBService:
             task_logger.error(f"❌ ID查询失败: {e}")
             return False
 
+    def delete_document(self, collection_name: str, query: dict) -> bool:
+        """
+        删除单个文档
+        :param collection_name: 集合名称
+        :param query: 查询条件
+        :return: 是否删除了文档
+        """
+        try:
+            result = self.db[collection_name].delete_one(query)
+            return result.deleted_count > 0
+        except PyMongoError as e:
+            task_logger.error(f"❌ 文档删除失败: {collection_name} {e}")
+            return False
+
     def insert_document(
         self, collection_name: str, document: dict, check_keys: bool = True
     ) -> str:
@@ -154,7 +269,7 @@ class MongoDBService:
         try:
             result = self.db[collection_name].insert_one(document)
             task_logger.info(
-                f"{collection_name} ✅ 文档插入成功 | ID: {result.inserted_id}"
+                "%s ✅ 文档插入成功 | ID: %s", collection_name, result.inserted_id
             )
             return str(result.inserted_id)
         except DuplicateKeyError as e:
@@ -175,13 +290,13 @@ class MongoDBService:
         self,
         collection_name: str,
         documents: list[dict],
-        ordered: bool = True,
+        ordered: bool = False,
         bypass_validation: bool = False,
     ) -> list[str]:
         """
         批量插入文档
         :param collection_name: 集合名称
-        :param ordered: 是否顺序写入（False时允许部分成功）
+        :param ordered: 是否顺序写入（默认False，单条重复不会中断整批写入）
         :param bypass_validation: 是否跳过数据验证
         :return: 成功插入的文档ID列表
         """
@@ -191,7 +306,7 @@ class MongoDBService:
             )
             success_count = len(result.inserted_ids)
             task_logger.info(
-                f"✅ 批量插入完成 | 成功: {success_count}/{len(documents)}"
+                "✅ 批量插入完成 | 成功: %d/%d", success_count, len(documents)
             )
             return [str(id) for id in result.inserted_ids]
         except BulkWriteError as e:
@@ -223,12 +338,156 @@ class MongoDBService:
             result = self.db[collection_name].update_one(
                 filter=query, update=update, upsert=upsert
             )
-            if result.modified_count > 0:
-                task_logger.info(f"✅ 文档更新成功 | ID: {query.get('id')}")
+            if result.modified_count > 0 or result.upserted_id is not None:
+                task_logger.info("✅ 文档更新成功 | ID: %s", query.get("id"))
                 return True
             else:
-                task_logger.info(f"❌ 文档未修改或不存在 | ID: {query.get('id')}")
+                task_logger.info("❌ 文档未修改或不存在 | ID: %s", query.get("id"))
                 return False
         except PyMongoError as e:
             task_logger.info(f"❌ 文档更新失败: {e}")
             return False
+
+
+class AsyncMongoDBService:
+    """基于motor的异步MongoDB服务，查询不阻塞事件循环
+
+    motor客户端绑定所在的事件循环，通过 for_current_loop 获取当前事件循环对应的实例；
+    每个客户端有独立的连接池和监控线程，事件循环关闭后需关闭对应的客户端
+    """
+
+    _instances = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def for_current_loop(cls) -> "AsyncMongoDBService":
+        """获取当前事件循环共享的实例，同时关闭已结束的事件循环遗留的实例"""
+        loop = asyncio.get_running_loop()
+        with cls._lock:
+            cls._close_finished_loops()
+            instance = cls._instances.get(loop)
+            if instance is None:
+                instance = cls._instances[loop] = cls()
+        return instance
+
+    @classmethod
+    def release(cls, loop: asyncio.AbstractEventLoop):
+        """关闭指定事件循环对应的实例，由创建事件循环的调用方在关闭事件循环前调用"""
+        with cls._lock:
+            instance = cls._instances.pop(loop, None)
+        if instance is not None:
+            instance.close()
+
+    @classmethod
+    def close_all(cls):
+        """关闭全部实例，进程退出时调用"""
+        with cls._lock:
+            instances = list(cls._instances.values())
+            cls._instances.clear()
+        for instance in instances:
+            instance.close()
+
+    @classmethod
+    def _close_finished_loops(cls):
+        """关闭已关闭的事件循环对应的实例（如 asyncio.run 结束后），调用方需持有锁"""
+        for loop in [loop for loop in cls._instances if loop.is_closed()]:
+            cls._instances.pop(loop).close()
+
+    def __init__(self):
+        self.client = AsyncIOMotorClient(
+            MONGODB_SETTINGS["uri"],
+            maxPoolSize=MONGODB_SETTINGS["pool_size"],
+            waitQueueTimeoutMS=5000,
+            serverSelectionTimeoutMS=3000,
+        )
+        self.db = self.client[MONGODB_SETTINGS["database"]]
+
+    def close(self):
+        """关闭MongoDB连接"""
+        if self.client:
+            self.client.close()
+            self.client = None
+
+    async def fetch_data(
+        self,
+        collection_name: str,
+        query: dict = None,
+        projection: dict = None,
+        sort_field: str = None,
+        sort_order: int = -1,
+        skip: int = None,
+        limit: int = None,
+        stream: bool = False,
+    ):
+        """
+        查询指定集合中的数据
+        :param collection_name: 集合名称
+        :param projection: 返回字段投影
+        :param sort_field: 排序字段
+        :param sort_order: 排序方式（-1降序/1升序）
+        :param limit: 返回结果数量限制
+        :param stream: 为True时直接返回游标，通过 async for 遍历，不一次性加载全部结果
+        :return: 文档列表（stream为True时返回游标）
+        """
+        try:
+            cursor = self.db[collection_name].find(
+                filter=query or {}, projection=projection or {"_id": 0}
+            )
+            if sort_field:
+                cursor = cursor.sort(sort_field, sort_order)
+            if skip:
+                cursor = cursor.skip(skip)
+            if limit:
+                cursor = cursor.limit(limit)
+            if stream:
+                return cursor
+            return await cursor.to_list(length=limit or None)
+        except PyMongoError as e:
+            task_logger.error(f"❌ 数据库查询错误: {e}")
+            return []
+
+    async def batch_fetch_by_ids(
+        self,
+        collection_name: str,
+        id_list: list[str],
+        ids_field: str = "id",
+        projection: dict = None,
+        chunk_size: int = BATCH_FETCH_CHUNK_SIZE,
+    ) -> list:
+        """
+        批量查询指定集合中的数据，ID较多时按 chunk_size 分批查询
+        :param collection_name: 集合名称
+        :param id_list: 需要查询的ID列表
+        :param ids_field: ID字段名称
+        :param projection: 返回字段投影
+        :param chunk_size: 每次查询的ID数量
+        :return: 文档列表
+        """
+        projection = projection or {"_id": 0}
+        result = []
+        for chunk in _chunked(id_list, chunk_size):
+            query = {ids_field: {"$in": chunk}}
+            result.extend(await self.fetch_data(collection_name, query, projection))
+        return result
+
+    async def check_id_exists(
+        self, collection_name: str, id: str, id_field: str = "id"
+    ) -> bool:
+        """
+        检查指定ID是否已存在集合中
+        :param collection_name: 集合名称
+        :param id: 要检查的唯一标识符
+        :param id_field: ID字段名称
+        :return: 存在返回True，否则返回False
+        """
+        try:
+            result = await self.db[collection_name].find_one(
+                {id_field: id}, projection={"_id": 1}
+            )
+            return result is not None
+        except PyMongoError as e:
+            task_logger.error(f"❌ ID查询失败: {e}")
+            return False
+
+
+atexit.register(AsyncMongoDBService.close_all)
@@ -13,6 +13,9 @@ from logger import setup_logger
 # 设置日志
 oss_logger = setup_logger("oss", "oss.log")
 
+# 压缩JPEG时是否让libjpeg在解码阶段按1/2、1/4、1/8缩小，减少需要解码的像素
+JPEG_DRAFT_ENABLED = True
+
 class OSSImageUploader:
     """阿里云OSS图片上传服务"""
     
@@ -143,8 +146,12 @@ class OSSImageUploader:
             # 如果图片宽度超过最大宽度，进行等比缩放
             if image.width > max_width:
                 ratio = max_width / image.width
-                new_height = int(image.height * ratio)
-                image = image.resize((max_width, new_height), Image.Resampling.LANCZOS)
+                new_height = max(int(image.height * ratio), 1)
+                if JPEG_DRAFT_ENABLED and image.format == 'JPEG':
+                    # 解码时直接缩小到不低于目标尺寸的最小比例，剩余不足2倍的缩放再由LANCZOS完成
+                    image.draft(image.mode, (max_width, new_height))
+                if image.width > max_width:
+                    image = image.resize((max_width, new_height), Image.Resampling.LANCZOS)
             
             # 转换为RGB模式（如果需要）
             if image.mode in ('RGBA', 'P'):
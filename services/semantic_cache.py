@@ -0,0 +1,150 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 向量矩阵的初始容量，写满后按2倍扩容直至 max_entries
+INITIAL_CAPACITY = 16
+# 查找时检查的最相似候选数，最相似的条目已过期时继续检查次相似的条目
+LOOKUP_CANDIDATES = 4
+
+
+def _vector_key(vector: np.ndarray) -> bytes:
+    """将归一化向量量化为int8后的字节串，作为精确匹配的键，忽略微小的浮点误差"""
+    return np.rint(np.asarray(vector, dtype=np.float32) * 127).astype(np.int8).tobytes()
+
+
+class SemanticCache:
+    """基于查询向量相似度的回答缓存
+
+    相似度超过阈值且未过期的历史查询直接复用其回答，跳过检索和LLM调用
+    """
+
+    def __init__(
+        self,
+        encoder,
+        vector_dim: int = 384,
+        similarity_threshold: float = 0.97,
+        ttl: int = 300,
+        max_entries: int = 1000,
+    ):
+        """
+        :param encoder: 向量模型（SentenceTransformer），与向量服务共用
+        :param vector_dim: 向量维度
+        :param similarity_threshold: 命中缓存所需的最低余弦相似度
+        :param ttl: 缓存有效期（秒）
+        :param max_entries: 最大缓存条数，超出时淘汰最久未使用的条目
+        """
+        self.encoder = encoder
+        self.vector_dim = vector_dim
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # 缓存条数较少，直接用连续的向量矩阵做内积，避免每次写入都维护索引
+        self._vectors = np.zeros(
+            (min(INITIAL_CAPACITY, max_entries), vector_dim), dtype=np.float32
+        )
+        # 与向量矩阵的前 len(_entries) 行一一对应：[回答, 是否使用了参考资料, 写入时间, 最近使用时间, 精确匹配键]
+        self._entries = []
+        # 精确匹配键到条目的映射，完全相同的查询无需计算相似度
+        self._exact: Dict[bytes, List] = {}
+        self._lock = threading.Lock()
+
+    def encode(self, query: str) -> np.ndarray:
+        """将查询编码为归一化的向量，形状为 (1, vector_dim)"""
+        vector = self.encoder.encode([query], normalize_embeddings=True)
+        return np.ascontiguousarray(vector, dtype=np.float32)
+
+    def lookup(self, query_vector: np.ndarray) -> Optional[Tuple[str, bool]]:
+        """查找相似查询的缓存回答，命中时返回 (回答, 是否使用了参考资料)"""
+        with self._lock:
+            size = len(self._entries)
+            if size == 0:
+                return None
+
+            now = time.monotonic()
+            entry = self._exact.get(_vector_key(query_vector[0]))
+            if entry is not None and now - entry[2] <= self.ttl:
+                entry[3] = now
+                return entry[0], entry[1]
+
+            query = np.asarray(query_vector[0], dtype=np.float32)
+            scores = self._vectors[:size] @ query
+            # 只对最相似的几个候选排序，argpartition 为线性复杂度
+            k = min(LOOKUP_CANDIDATES, size)
+            candidates = np.argpartition(-scores, k - 1)[:k]
+            candidates = candidates[np.argsort(-scores[candidates])]
+
+            for position in candidates:
+                if scores[position] < self.similarity_threshold:
+                    break
+                entry = self._entries[position]
+                if now - entry[2] <= self.ttl:
+                    entry[3] = now
+                    return entry[0], entry[1]
+            return None
+
+    def add(self, query_vector: np.ndarray, answer: str, context_used: bool):
+        """缓存查询向量对应的回答"""
+        with self._lock:
+            now = time.monotonic()
+            self._evict_expired(now)
+            if len(self._entries) >= self.max_entries:
+                # 淘汰最久未使用的条目
+                lru_position = min(
+                    range(len(self._entries)), key=lambda i: self._entries[i][3]
+                )
+                self._remove(lru_position)
+
+            self._ensure_capacity(len(self._entries) + 1)
+            self._vectors[len(self._entries)] = query_vector[0]
+            key = _vector_key(query_vector[0])
+            entry = [answer, context_used, now, now, key]
+            self._entries.append(entry)
+            self._exact[key] = entry
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries = []
+            self._exact = {}
+
+    def _ensure_capacity(self, size: int):
+        """向量矩阵容量不足时按2倍扩容，保持内存连续，调用方需持有锁"""
+        capacity = len(self._vectors)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        grown = np.zeros((min(capacity, self.max_entries), self.vector_dim), dtype=np.float32)
+        grown[: len(self._entries)] = self._vectors[: len(self._entries)]
+        self._vectors = grown
+
+    def _evict_expired(self, now: float):
+        """移除已过期的条目，调用方需持有锁"""
+        keep = [
+            i for i, entry in enumerate(self._entries) if now - entry[2] <= self.ttl
+        ]
+        if len(keep) < len(self._entries):
+            kept = set(keep)
+            for i, entry in enumerate(self._entries):
+                if i not in kept:
+                    self._drop_exact(entry)
+            self._vectors[: len(keep)] = self._vectors[keep]
+            self._entries = [self._entries[i] for i in keep]
+
+    def _remove(self, position: int):
+        """移除指定位置的条目，用最后一条填补空位，调用方需持有锁"""
+        self._drop_exact(self._entries[position])
+        last = len(self._entries) - 1
+        if position != last:
+            self._vectors[position] = self._vectors[last]
+            self._entries[position] = self._entries[last]
+        self._entries.pop()
+
+    def _drop_exact(self, entry: List):
+        """移除条目的精确匹配键，键已指向更新的条目时保留，调用方需持有锁"""
+        if self._exact.get(entry[4]) is entry:
+            del self._exact[entry[4]]
@@ -1,8 +1,11 @@
 import os
 import json
+import asyncio
 import pickle
+import threading
+from functools import lru_cache
 import numpy as np
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, KeysView, Optional, Tuple
 import faiss
 from sentence_transformers import SentenceTransformer
 from datetime import datetime
@@ -11,6 +14,19 @@ import hashlib
 from logger import task_logger
 from models.database import PostsDB
 
+# HNSW索引参数：每个节点的邻居数、构建和查询时的候选队列长度
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+# 同步帖子时每批编码和写入索引的文档数
+SYNC_BATCH_SIZE = 256
+
+
+@lru_cache(maxsize=None)
+def _load_embedding_model(model_name: str) -> SentenceTransformer:
+    """加载向量模型，同一进程内按模型名共享，避免重复加载"""
+    return SentenceTransformer(model_name)
+
 
 class VectorService:
     """基于FAISS的向量检索服务，替换Dify知识库功能"""
@@ -18,7 +34,7 @@ class VectorService:
     def __init__(self, model_name: str = "all-MiniLM-L6-v2", vector_dim: int = 384):
         self.model_name = model_name
         self.vector_dim = vector_dim
-        self.embeddings = SentenceTransformer(model_name)
+        self.embeddings = _load_embedding_model(model_name)
         
         # 存储路径
         self.storage_path = "vector_storage"
@@ -30,21 +46,48 @@ class VectorService:
         os.makedirs(self.storage_path, exist_ok=True)
         
         # 初始化索引
-        self.index = faiss.IndexFlatIP(vector_dim)  # 内积相似度
+        self.index = self._create_index()
         self.metadata = {}  # 存储文档元数据
         self.documents = {}  # 存储文档内容
         self.id_to_index = {}  # 文档ID到索引位置的映射
+        # 多线程并发添加文档时保护索引和元数据的写入，保存文件时也需持有
+        self._write_lock = threading.RLock()
         
         # 加载已有的索引和数据
         self._load_index()
         
         task_logger.info(f"向量服务初始化完成，当前索引文档数量: {self.index.ntotal}")
 
+    def _create_index(self):
+        """创建空的向量索引：基于内积相似度的HNSW图索引，检索复杂度约为O(log n)
+
+        向量以8位标量量化存储，内存占用约为float32的1/4
+        """
+        index = faiss.IndexHNSWSQ(
+            self.vector_dim, faiss.ScalarQuantizer.QT_8bit_uniform, HNSW_M, faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        # 向量已归一化，各分量位于[-1, 1]，直接用该范围训练量化器，无需语料
+        bounds = np.vstack([-np.ones(self.vector_dim), np.ones(self.vector_dim)]).astype('float32')
+        index.train(bounds)
+        return index
+
+    def _configure_index(self):
+        """设置从文件加载的索引的查询参数"""
+        if hasattr(self.index, "hnsw"):
+            self.index.hnsw.efSearch = HNSW_EF_SEARCH
+
+    def index_outdated(self) -> bool:
+        """当前索引类型是否与 _create_index 创建的不一致（如旧版本保存的暴力检索索引）"""
+        return type(self.index) is not type(self._create_index())
+
     def _load_index(self):
         """加载已保存的索引和元数据"""
         try:
             if os.path.exists(self.index_path):
                 self.index = faiss.read_index(self.index_path)
+                self._configure_index()
                 task_logger.info(f"成功加载FAISS索引，文档数量: {self.index.ntotal}")
             
             if os.path.exists(self.metadata_path):
@@ -63,7 +106,7 @@ class VectorService:
         except Exception as e:
             task_logger.error(f"加载索引失败: {str(e)}")
             # 如果加载失败，重新初始化
-            self.index = faiss.IndexFlatIP(self.vector_dim)
+            self.index = self._create_index()
             self.metadata = {}
             self.documents = {}
             self.id_to_index = {}
@@ -76,15 +119,22 @@ class VectorService:
                 self.id_to_index[doc_id] = meta['index_position']
 
     def _save_index(self):
-        """保存索引和元数据到文件"""
+        """保存索引和元数据到文件
+
+        先写入临时文件再替换，保存中途失败不会损坏已有文件
+        """
         try:
-            faiss.write_index(self.index, self.index_path)
-            
-            with open(self.metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(self.metadata, f, ensure_ascii=False, indent=2)
-            
-            with open(self.documents_path, 'w', encoding='utf-8') as f:
-                json.dump(self.documents, f, ensure_ascii=False, indent=2)
+            with self._write_lock:
+                faiss.write_index(self.index, self.index_path + ".tmp")
+                
+                with open(self.metadata_path + ".tmp", 'w', encoding='utf-8') as f:
+                    json.dump(self.metadata, f, ensure_ascii=False, indent=2)
+                
+                with open(self.documents_path + ".tmp", 'w', encoding='utf-8') as f:
+                    json.dump(self.documents, f, ensure_ascii=False, indent=2)
+                
+                for path in (self.index_path, self.metadata_path, self.documents_path):
+                    os.replace(path + ".tmp", path)
             
             task_logger.info("成功保存索引和元数据")
         except Exception as e:
@@ -129,8 +179,8 @@ class VectorService:
         
         return chunks
 
-    def add_document(self, doc_id: str, text: str, metadata: Dict = None) -> bool:
-        """添加文档到向量索引"""
+    def add_document(self, doc_id: str, text: str, metadata: Dict = None, save: bool = True) -> bool:
+        """添加文档到向量索引，save 为 False 时不保存到文件（由调用方统一保存）"""
         try:
             # 检查文档是否已存在
             if doc_id in self.documents:
@@ -143,93 +193,239 @@ class VectorService:
             # 分段处理
             chunks = self._split_text(processed_text)
             
-            # 生成向量
+            # 生成向量（不持有锁，多个线程可并发编码）
             vectors = self.embeddings.encode(chunks)
             
-            # 添加到索引
-            start_index = self.index.ntotal
-            self.index.add(vectors.astype('float32'))
-            
-            # 存储文档内容和元数据
-            self.documents[doc_id] = {
-                "text": text,
-                "processed_text": processed_text,
-                "chunks": chunks,
-                "chunk_count": len(chunks)
-            }
-            
-            # 存储元数据
-            doc_metadata = metadata or {}
-            doc_metadata.update({
-                "doc_id": doc_id,
-                "chunk_count": len(chunks),
-                "start_index": start_index,
-                "end_index": start_index + len(chunks) - 1,
-                "created_at": datetime.now().isoformat(),
-                "vector_model": self.model_name
-            })
-            
-            self.metadata[doc_id] = doc_metadata
-            
-            # 更新ID映射
-            for i, chunk in enumerate(chunks):
-                self.id_to_index[f"{doc_id}_chunk_{i}"] = start_index + i
-            
-            # 保存到文件
-            self._save_index()
-            
-            task_logger.info(f"成功添加文档 {doc_id}，分为 {len(chunks)} 个片段")
-            return True
+            with self._write_lock:
+                return self._add_vectors(doc_id, text, processed_text, chunks, vectors, metadata, save=save)
             
         except Exception as e:
             task_logger.error(f"添加文档失败: {str(e)}")
             return False
 
-    def search_similar(self, query: str, k: int = 5, score_threshold: float = 0.5) -> List[Dict]:
-        """搜索相似文档"""
+    def add_documents(self, items: List[Tuple[str, str, Dict]], save: bool = True) -> Dict[str, bool]:
+        """批量添加文档，所有文档的片段一次性编码
+
+        :param items: (文档ID, 文本, 元数据) 列表
+        :param save: 是否在添加完成后保存到文件
+        :return: 文档ID到是否添加成功的映射
+        """
+        results, prepared, all_chunks = self.prepare_documents(items)
+        if not prepared:
+            return results
+        
         try:
-            if self.index.ntotal == 0:
-                return []
+            vectors = self.embeddings.encode(
+                all_chunks, batch_size=128, convert_to_numpy=True, show_progress_bar=False
+            )
+        except Exception as e:
+            task_logger.error(f"批量生成向量失败: {str(e)}")
+            return results
+        
+        return self.add_encoded_documents(prepared, vectors, results, save=save)
+
+    def prepare_documents(self, items: List[Tuple[str, str, Dict]]) -> Tuple[Dict[str, bool], List[Tuple], List[str]]:
+        """批量添加前的预处理和分段
+
+        :return: (初始结果映射, 待添加文档列表, 所有待编码片段)，
+                 待添加文档的片段在所有片段中按顺序连续存放
+        """
+        results = {}
+        prepared = []
+        all_chunks = []
+        
+        for doc_id, text, metadata in items:
+            if doc_id in self.documents or doc_id in results:
+                results[doc_id] = True
+                continue
             
-            # 生成查询向量
-            query_vector = self.embeddings.encode([query]).astype('float32')
+            try:
+                processed_text = self._preprocess_text(text)
+                chunks = self._split_text(processed_text)
+            except Exception as e:
+                task_logger.error(f"添加文档失败: {doc_id} - {str(e)}")
+                results[doc_id] = False
+                continue
+            if not chunks:
+                task_logger.error(f"添加文档失败: {doc_id} 内容为空")
+                results[doc_id] = False
+                continue
             
-            # 搜索相似向量
-            scores, indices = self.index.search(query_vector, min(k * 2, self.index.ntotal))
+            prepared.append((doc_id, text, processed_text, chunks, metadata, len(all_chunks)))
+            all_chunks.extend(chunks)
+            # 先占位，避免同一批次中重复的文档ID被再次编码
+            results[doc_id] = False
+        
+        return results, prepared, all_chunks
+
+    def add_encoded_documents(self, prepared: List[Tuple], vectors: np.ndarray,
+                              results: Dict[str, bool], save: bool = True) -> Dict[str, bool]:
+        """将 prepare_documents 得到的文档及其已编码向量一次性加入索引"""
+        with self._write_lock:
+            # 编码期间其他线程可能已添加了相同文档，重新过滤
+            new_docs = [item for item in prepared if item[0] not in self.documents]
+            for item in prepared:
+                results[item[0]] = True
+            if not new_docs:
+                return results
+            
+            if len(new_docs) < len(prepared):
+                vectors = np.vstack([
+                    vectors[offset:offset + len(chunks)]
+                    for _, _, _, chunks, _, offset in new_docs
+                ])
+            
+            try:
+                # 整批向量一次性加入索引
+                start_index = self.index.ntotal
+                self.index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+            except Exception as e:
+                task_logger.error(f"批量添加向量失败: {str(e)}")
+                for item in new_docs:
+                    results[item[0]] = False
+                return results
+            
+            for doc_id, text, processed_text, chunks, metadata, _ in new_docs:
+                self._register_document(doc_id, text, processed_text, chunks, start_index, metadata)
+                start_index += len(chunks)
+            
+            if save:
+                self._save_index()
+        
+        task_logger.info(f"成功批量添加 {len(new_docs)} 个文档，共 {len(vectors)} 个片段")
+        return results
+
+    def _add_vectors(self, doc_id: str, text: str, processed_text: str, chunks: List[str],
+                     vectors: np.ndarray, metadata: Dict = None, save: bool = True) -> bool:
+        """将已编码的文档片段写入索引和元数据，调用方需持有写锁"""
+        if doc_id in self.documents:
+            return True
+        
+        # 添加到索引
+        start_index = self.index.ntotal
+        self.index.add(vectors.astype('float32'))
+        self._register_document(doc_id, text, processed_text, chunks, start_index, metadata)
+        
+        # 保存到文件
+        if save:
+            self._save_index()
+        
+        task_logger.info(f"成功添加文档 {doc_id}，分为 {len(chunks)} 个片段")
+        return True
+
+    def _register_document(self, doc_id: str, text: str, processed_text: str, chunks: List[str],
+                           start_index: int, metadata: Dict = None):
+        """记录已加入索引的文档内容、元数据和片段位置"""
+        # 存储文档内容和元数据
+        self.documents[doc_id] = {
+            "text": text,
+            "processed_text": processed_text,
+            "chunks": chunks,
+            "chunk_count": len(chunks)
+        }
+        
+        # 存储元数据
+        doc_metadata = metadata or {}
+        doc_metadata.update({
+            "doc_id": doc_id,
+            "chunk_count": len(chunks),
+            "start_index": start_index,
+            "end_index": start_index + len(chunks) - 1,
+            "created_at": datetime.now().isoformat(),
+            "vector_model": self.model_name
+        })
+        
+        self.metadata[doc_id] = doc_metadata
+        
+        # 更新ID映射
+        for i, chunk in enumerate(chunks):
+            self.id_to_index[f"{doc_id}_chunk_{i}"] = start_index + i
+
+    def search_similar(
+        self, query: str, k: int = 5, score_threshold: float = 0.5, query_vector: Optional[np.ndarray] = None
+    ) -> List[Dict]:
+        """搜索相似文档，已有查询向量时传入 query_vector 跳过编码"""
+        return self.search_similar_batch([query], [k], score_threshold, [query_vector])[0]
+
+    def search_similar_batch(
+        self,
+        queries: List[str],
+        ks: List[int],
+        score_threshold: float = 0.5,
+        query_vectors: Optional[List[Optional[np.ndarray]]] = None,
+    ) -> List[List[Dict]]:
+        """批量搜索相似文档：所有查询一次编码、一次检索
+
+        :param queries: 查询文本列表
+        :param ks: 每个查询返回的最大文档数量
+        :param query_vectors: 与查询一一对应的已编码向量，为None的查询才重新编码
+        :return: 与查询顺序一致的结果列表
+        """
+        try:
+            if self.index.ntotal == 0:
+                return [[] for _ in queries]
             
-            # 处理结果
-            results = []
-            seen_docs = set()
+            # 生成查询向量
+            query_vectors = self._encode_queries(queries, query_vectors)
             
-            for score, idx in zip(scores[0], indices[0]):
-                if score < score_threshold:
-                    continue
-                
-                # 找到对应的文档
-                doc_id = self._find_doc_by_index(idx)
-                if doc_id and doc_id not in seen_docs:
-                    seen_docs.add(doc_id)
-                    
-                    doc_data = self.documents.get(doc_id, {})
-                    doc_metadata = self.metadata.get(doc_id, {})
-                    
-                    result = {
-                        "doc_id": doc_id,
-                        "score": float(score),
-                        "content": doc_data.get("text", ""),
-                        "metadata": doc_metadata,
-                        "chunk_hit": self._get_chunk_content(doc_id, idx)
-                    }
-                    results.append(result)
-                    
-                    if len(results) >= k:
-                        break
+            # 搜索相似向量（按最大的k取候选，各查询再分别截取）
+            scores, indices = self.index.search(
+                query_vectors, min(max(ks) * 2, self.index.ntotal)
+            )
             
-            return results
+            return [
+                self._collect_results(row_scores, row_indices, k, score_threshold)
+                for row_scores, row_indices, k in zip(scores, indices, ks)
+            ]
             
         except Exception as e:
             task_logger.error(f"搜索失败: {str(e)}")
-            return []
+            return [[] for _ in queries]
+
+    def _encode_queries(
+        self, queries: List[str], query_vectors: Optional[List[Optional[np.ndarray]]] = None
+    ) -> np.ndarray:
+        """编码查询文本，已提供向量的查询直接复用"""
+        vectors = list(query_vectors) if query_vectors else [None] * len(queries)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = self.embeddings.encode([queries[i] for i in missing])
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+        return np.ascontiguousarray(
+            np.vstack([np.reshape(vector, (1, -1)) for vector in vectors]), dtype='float32'
+        )
+
+    def _collect_results(self, scores: np.ndarray, indices: np.ndarray, k: int, score_threshold: float) -> List[Dict]:
+        """将单个查询的检索结果转换为去重后的文档列表"""
+        results = []
+        seen_docs = set()
+        
+        for score, idx in zip(scores, indices):
+            if score < score_threshold:
+                continue
+            
+            # 找到对应的文档
+            doc_id = self._find_doc_by_index(idx)
+            if doc_id and doc_id not in seen_docs:
+                seen_docs.add(doc_id)
+                
+                doc_data = self.documents.get(doc_id, {})
+                doc_metadata = self.metadata.get(doc_id, {})
+                
+                result = {
+                    "doc_id": doc_id,
+                    "score": float(score),
+                    "content": doc_data.get("text", ""),
+                    "metadata": doc_metadata,
+                    "chunk_hit": self._get_chunk_content(doc_id, idx)
+                }
+                results.append(result)
+                
+                if len(results) >= k:
+                    break
+        
+        return results
 
     def _find_doc_by_index(self, index: int) -> Optional[str]:
         """根据索引位置找到对应的文档ID"""
@@ -322,7 +518,7 @@ class VectorService:
             ]
             
             # 重新初始化索引
-            self.index = faiss.IndexFlatIP(self.vector_dim)
+            self.index = self._create_index()
             new_metadata = {}
             new_documents = {}
             self.id_to_index = {}
@@ -371,7 +567,7 @@ class VectorService:
         """清除所有数据"""
         try:
             # 重新初始化内存中的数据结构
-            self.index = faiss.IndexFlatL2(self.vector_dim)
+            self.index = self._create_index()
             self.metadata = {}
             self.documents = {}
             self.id_to_index = {}
@@ -402,12 +598,73 @@ class VectorService:
             return False
 
 
+class QueryBatcher:
+    """合并短时间内并发到达的检索请求，一次编码、一次检索"""
+
+    def __init__(self, vector_service: VectorService, max_batch: int = 32, max_wait: float = 0.005):
+        """
+        :param vector_service: 向量服务
+        :param max_batch: 每批最多合并的查询数量
+        :param max_wait: 收到第一个查询后等待更多查询的最长时间（秒）
+        """
+        self.vector_service = vector_service
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        # 队列和后台任务绑定到所在的事件循环，循环变化时重新创建
+        self._loop = None
+        self._queue = None
+        self._task = None
+
+    async def search(self, query: str, k: int = 5, query_vector: Optional[np.ndarray] = None) -> List[Dict]:
+        """提交一个查询并等待其检索结果，已有查询向量时传入 query_vector 跳过编码"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run(self._queue))
+        
+        future = loop.create_future()
+        await self._queue.put((query, k, query_vector, future))
+        return await future
+
+    async def _run(self, queue: asyncio.Queue):
+        """后台任务：按批次取出查询并执行检索"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                results = await asyncio.to_thread(
+                    self.vector_service.search_similar_batch,
+                    [query for query, _, _, _ in batch],
+                    [k for _, k, _, _ in batch],
+                    query_vectors=[query_vector for _, _, query_vector, _ in batch],
+                )
+                for (_, _, _, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                for _, _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
 class DocumentManager:
     """文档管理器，提供与Dify API兼容的接口"""
     
     def __init__(self):
         self.vector_service = VectorService()
         self.posts_db = PostsDB()
+        self.query_batcher = QueryBatcher(self.vector_service)
 
     async def sync_posts_to_vector(self, type_filter: List[str] = None):
         """同步帖子到向量数据库"""
@@ -419,6 +676,7 @@ class DocumentManager:
             for post_type in types_to_sync:
                 posts = await self.posts_db.get_posts(type=post_type, limit=None)
                 
+                items = []
                 for post in posts:
                     doc_id = post["md5"]
                     
@@ -435,19 +693,22 @@ class DocumentManager:
                         "title": post.get("title", ""),
                         "source": "posts_db"
                     }
-                    
-                    # 添加到向量数据库
-                    success = self.vector_service.add_document(
-                        doc_id=doc_id,
-                        text=post["mes"],
-                        metadata=metadata
+                    items.append((doc_id, post["mes"], metadata))
+                
+                # 按批次添加到向量数据库，每批一次编码、一次写入索引，全部完成后统一保存
+                for start in range(0, len(items), SYNC_BATCH_SIZE):
+                    results = await asyncio.to_thread(
+                        self.vector_service.add_documents,
+                        items[start:start + SYNC_BATCH_SIZE],
+                        save=False,
                     )
-                    
-                    if success:
-                        task_logger.info(f"成功同步文档: {doc_id}")
-                    else:
-                        task_logger.error(f"同步文档失败: {doc_id}")
+                    for doc_id, success in results.items():
+                        if success:
+                            task_logger.info(f"成功同步文档: {doc_id}")
+                        else:
+                            task_logger.error(f"同步文档失败: {doc_id}")
             
+            self.vector_service.save_index()
             task_logger.info("文档同步完成")
             return True
             
@@ -473,6 +734,26 @@ class DocumentManager:
             task_logger.error(f"搜索相关帖子失败: {str(e)}")
             return []
 
+    async def asearch_related_posts(
+        self, query: str, post_type: str = None, k: int = 5, query_vector: Optional[np.ndarray] = None
+    ) -> List[Dict]:
+        """异步搜索相关帖子，并发的查询会被合并为一次批量检索"""
+        try:
+            results = await self.query_batcher.search(query, k=k * 2, query_vector=query_vector)
+            
+            # 如果指定了类型，过滤结果
+            if post_type:
+                results = [
+                    result for result in results
+                    if result.get("metadata", {}).get("post_type") == post_type
+                ]
+            
+            return results[:k]
+            
+        except Exception as e:
+            task_logger.error(f"搜索相关帖子失败: {str(e)}")
+            return []
+
     def get_document_by_id(self, doc_id: str) -> Optional[Dict]:
         """根据ID获取文档"""
         return self.vector_service.get_document(doc_id)
@@ -510,12 +791,26 @@ class DocumentManager:
     
     def add_document(self, doc_id: str, content: str, metadata: Dict = None, save_immediately: bool = True) -> bool:
         """添加文档到向量数据库"""
-        success = self.vector_service.add_document(doc_id, content, metadata)
-        if success and not save_immediately:
-            # 如果指定不立即保存，则跳过自动保存（用于批量操作）
-            pass
-        return success
+        # 不立即保存时跳过写文件（用于批量操作，由调用方统一保存）
+        return self.vector_service.add_document(doc_id, content, metadata, save=save_immediately)
+    
+    def load_existing_ids(self) -> KeysView[str]:
+        """获取向量数据库中已有文档ID的实时视图
+
+        直接返回文档字典的键视图，不复制ID，新添加的文档会自动反映在视图中
+        """
+        return self.vector_service.documents.keys()
+    
+    def add_documents(self, items: List[Tuple[str, str, Dict]], save_immediately: bool = True) -> Dict[str, bool]:
+        """批量添加文档到向量数据库，items 为 (文档ID, 内容, 元数据) 列表"""
+        return self.vector_service.add_documents(items, save=save_immediately)
     
     def remove_document(self, doc_id: str) -> bool:
         """删除文档"""
-        return self.vector_service.delete_document(doc_id) 
\ No newline at end of file
+        return self.vector_service.delete_document(doc_id) 
+
+
+@lru_cache(maxsize=1)
+def get_document_manager() -> DocumentManager:
+    """获取共享的文档管理器实例，同一进程内复用向量模型和已加载的索引"""
+    return DocumentManager()
@@ -83,8 +83,9 @@ async def simple_chat():
                 }
             ]
             
-            for doc in sample_docs:
-                doc_manager.add_document(**doc)
+            doc_manager.add_documents(
+                [(doc["doc_id"], doc["content"], doc["metadata"]) for doc in sample_docs]
+            )
             print("✅ 示例数据添加完成")
         else:
             print(f"✅ 向量数据库包含 {doc_count} 个文档")
@@ -107,10 +107,11 @@ class FaissReplacementTester:
             ]
             
             # 批量添加
-            success_count = 0
-            for doc in test_docs:
-                if self.doc_manager.add_document(**doc, save_immediately=False):
-                    success_count += 1
+            results = self.doc_manager.add_documents(
+                [(doc["doc_id"], doc["content"], doc["metadata"]) for doc in test_docs],
+                save_immediately=False,
+            )
+            success_count = sum(results.values())
             
             # 保存索引
             self.doc_manager.vector_service.save_index()
@@ -164,8 +165,9 @@ class FaissReplacementTester:
             ]
             
             # 添加测试文档
-            for doc in test_financial_docs:
-                self.doc_manager.add_document(**doc)
+            self.doc_manager.add_documents(
+                [(doc["doc_id"], doc["content"], doc["metadata"]) for doc in test_financial_docs]
+            )
             
             # 测试聊天功能
             test_query = "今天股市行情如何？"
@@ -184,7 +186,7 @@ class FaissReplacementTester:
             
             # 测试对话历史
             conversation_id = chat_result["conversation_id"]
-            history = self.chat_service.get_conversation_history(conversation_id, "test_user")
+            history = await self.chat_service.get_conversation_history(conversation_id, "test_user")
             
             if not history:
                 raise Exception("对话历史为空")
@@ -193,7 +195,7 @@ class FaissReplacementTester:
             for doc in test_financial_docs:
                 self.doc_manager.remove_document(doc["doc_id"])
             
-            self.chat_service.clear_conversation(conversation_id, "test_user")
+            await self.chat_service.clear_conversation(conversation_id, "test_user")
             
             duration = time.time() - start_time
             self.add_test_result("聊天服务", True, f"成功处理查询并生成回答", duration)
@@ -230,8 +232,10 @@ class FaissReplacementTester:
             
             # 测试批量添加性能
             batch_start = time.time()
-            for doc in test_docs:
-                self.doc_manager.add_document(**doc, save_immediately=False)
+            self.doc_manager.add_documents(
+                [(doc["doc_id"], doc["content"], doc["metadata"]) for doc in test_docs],
+                save_immediately=False,
+            )
             self.doc_manager.vector_service.save_index()
             batch_duration = time.time() - batch_start
             
@@ -1,7 +1,7 @@
 import re
 import json
 from typing import List, Dict, Tuple
-from services.llm import LLMService
+from services.llm import get_llm_service
 from logger import task_logger
 
 class HTMLContentProcessor:
@@ -11,7 +11,7 @@ class HTMLContentProcessor:
         self.div_pattern = r'<div[^>]*class="image-container"[^>]*>.*?</div>'
         self.img_pattern = r'<img[^>]*src="([^"]*)"[^>]*>'
         # 初始化LLM服务
-        self.llm_service = LLMService()
+        self.llm_service = get_llm_service()
     
     def extract_div_blocks(self, content: str) -> List[Dict]:
         """提取文章中的div块"""
@@ -96,6 +96,7 @@ class HTMLContentProcessor:
             # 使用LLM服务的统一调用方法
             think_response, json_response = self.llm_service.call_llm(
                 messages=messages,
+                json_mode=True,
                 max_retries=3,
                 timeout=(30, 60)  # 图片分析可能需要更长时间
             )
@@ -7,6 +7,7 @@ from typing import List, Callable, Any, Dict
 
 from config.settings import PROCESS_POOL
 from logger import task_logger
+from services.mongodb import AsyncMongoDBService
 
 
 class TaskManager:
@@ -115,6 +116,8 @@ class TaskManager:
                     self._run_async_in_process(async_func, chunk, **kwargs)
                 )
             finally:
+                # 关闭该事件循环上创建的异步MongoDB客户端，释放连接池和监控线程
+                AsyncMongoDBService.release(loop)
                 loop.close()
         except Exception as e:
             task_logger.error(f"进程工作函数执行失败: {str(e)}", exc_info=True)
@@ -159,21 +162,28 @@ class TaskManager:
 
                 return valid_results
             finally:
+                # 关闭该事件循环上创建的异步MongoDB客户端，释放连接池和监控线程
+                AsyncMongoDBService.release(loop)
                 loop.close()
 
-        # 使用线程池
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=thread_count
-        ) as executor:
-            futures = [executor.submit(thread_worker, chunk) for chunk in chunks]
+        # 使用线程池，通过 await 等待结果，不阻塞当前事件循环，调用方的其他协程可以并发执行
+        loop = asyncio.get_running_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=thread_count)
+        try:
+            futures = [
+                loop.run_in_executor(executor, thread_worker, chunk) for chunk in chunks
+            ]
 
             # 收集结果
-            for future in concurrent.futures.as_completed(futures):
+            for future in asyncio.as_completed(futures):
                 try:
-                    result = future.result()
+                    result = await future
                     all_results.extend(result)
                 except Exception as e:
                     task_logger.error(f"线程任务执行失败: {str(e)}", exc_info=True)
+        finally:
+            # 所有任务均已完成，无需阻塞等待线程退出
+            executor.shutdown(wait=False)
 
         return all_results
 
@@ -235,28 +245,37 @@ class TaskManager:
 
                 task_logger.info(f"使用多进程模式，进程数: {process_count}")
 
-                # 创建进程池执行任务
+                # 创建进程池执行任务，通过 await 等待结果，不阻塞当前事件循环
                 all_results = []
-                with concurrent.futures.ProcessPoolExecutor(
+                loop = asyncio.get_running_loop()
+                executor = concurrent.futures.ProcessPoolExecutor(
                     max_workers=process_count
-                ) as executor:
+                )
+                try:
                     # 提交所有任务
                     futures = [
-                        executor.submit(
-                            self._process_worker, func_name, func_module, chunk, kwargs
+                        loop.run_in_executor(
+                            executor,
+                            self._process_worker,
+                            func_name,
+                            func_module,
+                            chunk,
+                            kwargs,
                         )
                         for chunk in items
                     ]
 
                     # 收集结果
-                    for future in concurrent.futures.as_completed(futures):
+                    for future in asyncio.as_completed(futures):
                         try:
-                            result = future.result()
+                            result = await future
                             all_results.extend(result)
                         except Exception as e:
                             task_logger.error(
                                 f"进程任务执行失败: {str(e)}", exc_info=True
                             )
+                finally:
+                    executor.shutdown(wait=False)
 
                 return all_results
 